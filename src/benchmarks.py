@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import math
+import os
+import random
+import tempfile
+import time
+import timeit
+
+from src.bundles import SegmentBundles, pack_bundles
+from src.client import read_tile
+from src.codec import TextCodec, BinaryCodec, LENGTH
+from src.dash import Dash, TILED, BOLA, MPC
+from src.data_types import QUICPacket, VideoPacket
+from src.prediction import PopularityHeatmap, create_predictor, shift_grid, tiles_to_grid, grid_to_tiles, \
+    REPLAY_PREDICTOR, LAST_PREDICTOR, LINEAR_PREDICTOR, HEATMAP_PREDICTOR, HYBRID_PREDICTOR
+from src.push import PushPlanner
+from src.queues import WeightedFairQueue
+from src.manifest import ManifestIndex
+from src.segment_cache import SegmentCache, frame_file
+from src.viewport import ViewportTrace
+from src.utils import get_server_file_name
+from src.video_constants import HIGH_PRIORITY, LOW_PRIORITY, N_SEGMENTS, MAX_TILE, VIDEO_FPS, SEGMENT_TIME, \
+    BUNDLE_LOCATION
+
+# Payload carried by each simulated QUIC packet
+DATAGRAM_SIZE = 1200
+
+
+def report(name, runs, seconds):
+    print(name.ljust(32) + str(round(runs / seconds)).rjust(12) + " ops/s" +
+          str(round(seconds / runs * 1e6, 3)).rjust(12) + " us/op")
+
+def benchmark_codec(runs):
+    request = QUICPacket('1', False, VideoPacket(3, 120, HIGH_PRIORITY, 5))
+    header = VideoPacket(3, 120, HIGH_PRIORITY, 5)
+
+    for codec in [TextCodec(), BinaryCodec()]:
+        name = type(codec).__name__
+        request_data = bytes(codec.frame_request(request))[LENGTH.size:]
+        header_data = bytes(codec.frame_header(header))[LENGTH.size:]
+
+        report(name + " encode request", runs, timeit.timeit(lambda: codec.frame_request(request), number=runs))
+        report(name + " decode request", runs, timeit.timeit(lambda: codec.decode_request(request_data), number=runs))
+        report(name + " encode header", runs, timeit.timeit(lambda: codec.frame_header(header), number=runs))
+        report(name + " decode header", runs, timeit.timeit(lambda: codec.decode_header(header_data), number=runs))
+
+
+async def read_tiles(framed_tiles):
+    reader = asyncio.StreamReader()
+
+    async def feed():
+        for framed in framed_tiles:
+            for offset in range(0, len(framed), DATAGRAM_SIZE):
+                reader.feed_data(framed[offset:offset + DATAGRAM_SIZE])
+                await asyncio.sleep(0)
+        reader.feed_eof()
+
+    asyncio.ensure_future(feed())
+    tile_buffer = bytearray(64 * 1024)
+    received = 0
+    for _ in framed_tiles:
+        payload = await read_tile(reader, tile_buffer)
+        received += len(payload)
+        payload.release()
+    return received
+
+def benchmark_framing(chunk_sizes, bitrate):
+    for chunk_size in chunk_sizes:
+        framed_tiles = [frame_file(get_server_file_name(segment, tile, bitrate), chunk_size)[1]
+                        for segment in range(1, N_SEGMENTS + 1) for tile in range(1, MAX_TILE)]
+
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        received = asyncio.run(read_tiles(framed_tiles))
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+        name = "whole tile" if chunk_size == 0 else str(chunk_size) + " byte chunks"
+        print(name.ljust(20) + str(round(received / wall / 1e6, 2)).rjust(10) + " MB/s" +
+              str(round(cpu / len(framed_tiles) * 1e6, 1)).rjust(10) + " us CPU/tile")
+
+
+def benchmark_wfq(runs):
+    for n_classes in [2, 4, 16, 64]:
+        queue = WeightedFairQueue(weights=[1] * n_classes)
+        items = [(index % n_classes + 1, 1000 + index % 7 * 100, index) for index in range(runs)]
+        start = time.perf_counter()
+        for item in items:
+            queue.put_nowait(item)
+        while not queue.empty():
+            queue.get_nowait()
+        report("WFQ put + get, " + str(n_classes) + " classes", runs, time.perf_counter() - start)
+
+
+def read_user_input(file_name):
+    """
+    FOV tiles of every frame of a user input CSV or of the first user of a binary trace file.
+    """
+    return [tiles.tolist() for tiles in ViewportTrace.read(file_name).tiles[1:]]
+
+def evaluate_predictor(name, frames, heatmap, bitrate):
+    """
+    Replays a viewer through a push planner using the predictor: the FOV of the first frame of each segment is
+    requested, and the tiles pushed for the next segment are compared with the tiles in the FOV during any of its
+    frames. Segment files repeat when the trace is longer than the video. Returns (FOV tiles pushed, FOV tiles, bytes
+    pushed).
+    """
+    frames_per_segment = SEGMENT_TIME * VIDEO_FPS
+    n_segments = len(frames) // frames_per_segment
+    planner = PushPlanner(1, create_predictor(name, heatmap), n_segments)
+    hits = total = pushed_bytes = 0
+
+    for segment in range(1, n_segments):
+        fov = frames[(segment - 1) * frames_per_segment]
+        others = sorted(set(range(1, MAX_TILE)) - set(fov))
+        requests = [(HIGH_PRIORITY, tile, bitrate) for tile in fov] + [(LOW_PRIORITY, tile, bitrate) for tile in others]
+        pushes = planner.plan(segment, requests, math.inf, 0)
+
+        viewed = set().union(*frames[segment * frames_per_segment:(segment + 1) * frames_per_segment])
+        hits += len(viewed & {tile for _, _, tile, _ in pushes})
+        total += len(viewed)
+        pushed_bytes += sum(os.path.getsize(get_server_file_name(push_segment % N_SEGMENTS + 1, tile, push_bitrate))
+                            for push_segment, _, tile, push_bitrate in pushes)
+
+    return hits, total, pushed_bytes
+
+def benchmark_predictors(user_input, viewers, bitrate):
+    frames = read_user_input(user_input)
+    n_segments = len(frames) // (SEGMENT_TIME * VIDEO_FPS)
+
+    # Other viewers of the video, for the heatmap: the same trace moved by up to 2 tiles
+    rng = random.Random(1)
+    heatmap = PopularityHeatmap(n_segments)
+    for _ in range(viewers):
+        rows, cols = rng.randint(-1, 1), rng.randint(-2, 2)
+        moved = [grid_to_tiles(shift_grid(tiles_to_grid(fov), rows, cols)) for fov in frames]
+        evaluate_predictor(HEATMAP_PREDICTOR, moved, heatmap, bitrate)
+
+    for name in [REPLAY_PREDICTOR, LAST_PREDICTOR, LINEAR_PREDICTOR, HEATMAP_PREDICTOR, HYBRID_PREDICTOR]:
+        # Each predictor starts from the heatmap of the other viewers only
+        shared = PopularityHeatmap(n_segments)
+        shared.counts[:], shared.views[:] = heatmap.counts, heatmap.views
+        hits, total, pushed_bytes = evaluate_predictor(name, frames, shared, bitrate)
+        print(name.ljust(10) + (str(round(hits / total * 100, 1)) + "% FOV hit").rjust(16) +
+              (str(round(pushed_bytes / 1e6, 2)) + " MB pushed").rjust(18) +
+              (str(round(hits / max(pushed_bytes, 1) * 1e6, 1)) + " hits/MB").rjust(16))
+
+def benchmark_abr(runs, user_input):
+    """
+    Time of a per tile bitrate selection by the tiled algorithm, over the FOVs of the user input at several
+    throughputs, and of a decision of the buffer based algorithms.
+    """
+    masks = ViewportTrace.read(user_input).masks[1:]
+    for throughput in [0.5, 1, 2, 5]:
+        dash = Dash([1, 2, 5], TILED)
+        dash.estimator.add(throughput)
+        seconds = timeit.timeit(lambda: dash.get_tile_bitrates(1, masks[random.randrange(len(masks))]),
+                                number=runs)
+        report("tiled " + str(throughput) + " Mbps", runs, seconds)
+
+    start = time.perf_counter()
+    mpc = Dash([1, 2, 5], MPC)
+    print("MPC decision table of " + str(mpc.mpc.table.size) + " entries built in " +
+          str(round((time.perf_counter() - start) * 1000, 1)) + " ms")
+    for name in [BOLA, MPC]:
+        dash = Dash([1, 2, 5], name, 4 * SEGMENT_TIME) if name != MPC else mpc
+        dash.estimator.add(2)
+        def decide():
+            dash.update_buffer_level(random.random() * 4)
+            return dash.get_next_bitrate(1)
+        report(name, runs, timeit.timeit(decide, number=runs))
+
+def benchmark_bundles(chunk_sizes, bitrate, location):
+    """
+    Tiles served per second by an uncached segment cache, from one file per tile and from bundle files (packed in a
+    temporary directory when location has none).
+    """
+    manifest = ManifestIndex.load()
+    tiles = [(segment, tile) for segment in range(1, manifest.n_segments + 1) for tile in range(1, MAX_TILE)
+             if manifest.exists(segment, tile, bitrate)]
+    codec = BinaryCodec()
+
+    with tempfile.TemporaryDirectory() as packed:
+        if not os.path.isdir(location) or not os.listdir(location):
+            pack_bundles(manifest, packed)
+            location = packed
+
+        sources = [("files", None), ("bundles", SegmentBundles(location))]
+        for chunk_size in chunk_sizes:
+            for name, segments in sources:
+                cache = SegmentCache(0, segments, manifest)
+                def serve():
+                    for segment, tile in tiles:
+                        cache.get(segment, tile, bitrate, codec, chunk_size)
+                seconds = min(timeit.repeat(serve, number=1, repeat=5))
+                report(name + " (chunk size " + str(chunk_size) + ")", len(tiles), seconds)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the streaming components")
+    parser.add_argument(
+        "benchmark",
+        type=str,
+        choices=["codec", "framing", "wfq", "predictors", "abr", "bundles"],
+        help="the benchmark to run",
+    )
+    parser.add_argument(
+        "-n",
+        "--runs",
+        type=int,
+        default=100000,
+        help="number of iterations per measurement (defaults to 100000)",
+    )
+    parser.add_argument(
+        "--chunk-sizes",
+        type=str,
+        default="1024,16384,0",
+        help="comma separated chunk sizes for the framing and bundles benchmarks, 0 = whole tile (defaults to "
+             "1024,16384,0)",
+    )
+    parser.add_argument(
+        "--bitrate",
+        type=int,
+        default=5,
+        help="bitrate of the segment files used by the file based benchmarks (defaults to 5)",
+    )
+    parser.add_argument(
+        "-i",
+        "--user-input",
+        type=str,
+        default="data/user_input.csv",
+        help="user input CSV or binary trace file replayed by the predictors and abr benchmarks (defaults to data/user_input.csv)",
+    )
+    parser.add_argument(
+        "--bundles",
+        type=str,
+        default=BUNDLE_LOCATION,
+        help="bundle files served by the bundles benchmark, packed for it when there are none (defaults to "
+             "data/bundles/)",
+    )
+    parser.add_argument(
+        "--viewers",
+        type=int,
+        default=8,
+        help="other viewers the heatmap of the predictors benchmark is built from, each the user input moved by up "
+             "to 2 tiles (defaults to 8)",
+    )
+    args = parser.parse_args()
+
+    if args.benchmark == "codec":
+        benchmark_codec(args.runs)
+    elif args.benchmark == "framing":
+        benchmark_framing([int(size) for size in args.chunk_sizes.split(",")], args.bitrate)
+    elif args.benchmark == "wfq":
+        benchmark_wfq(args.runs)
+    elif args.benchmark == "predictors":
+        benchmark_predictors(args.user_input, args.viewers, args.bitrate)
+    elif args.benchmark == "abr":
+        benchmark_abr(args.runs, args.user_input)
+    elif args.benchmark == "bundles":
+        benchmark_bundles([int(size) for size in args.chunk_sizes.split(",")], args.bitrate, args.bundles)
@@ -1,36 +1,115 @@
-import time
+import asyncio
+
+import numpy as np
+
+from src.video_constants import MAX_TILE
+
 
 class Buffer():
-    def __init__(self, n_segments, segment_time):
+    """
+    Playout buffer of the client: how many seconds of each tile of each segment were received, and where playback is.
+
+    Playback never pauses, so a stall is the time during which at least one tile of the viewport is missing from the
+    segment being played. Coroutines can wait for a buffer condition instead of polling it.
+    """
+    def __init__(self, n_segments, segment_time, n_tiles=MAX_TILE):
         self.n_segments = n_segments
         self.segment_time = segment_time
-        self.producer_current = 0
-        self.consumer_current = 0
+        self.fill = np.zeros((n_segments + 2, n_tiles))
+        self.position = 0.0
+        self.viewport = np.array([], dtype=int)
         self.finished = False
-        self.lockings = 0
-        self.timer = 0
+        self.stalled = False
+        self.stall_start = 0.0
+        self.stalls = []
+        self._waiters = []
 
-    def write(self):
-        #print('Buffer: write')
-        self.producer_current += 1
+    def write(self, segment, tile, seconds=None):
+        segment = int(segment)
+        if not 0 < segment <= self.n_segments:
+            return
 
-    def read(self):
-        #print('Buffer: read')
-        self.consumer_current += 1
+        if seconds is None:
+            seconds = self.segment_time
+        self.fill[segment, int(tile)] = min(self.fill[segment, int(tile)] + seconds, self.segment_time)
+        self._notify()
 
-    def finish(self):
-        #print('Buffer: finished')
-        self.finished = True
+    def current_segment(self):
+        return min(int(self.position // self.segment_time) + 1, self.n_segments + 1)
+
+    def levels(self, tiles=None):
+        """
+        Seconds of contiguous content buffered ahead of the playback position for each tile (all tiles by default).
+        """
+        if tiles is None:
+            tiles = slice(1, None)
+        segment = self.current_segment()
+        complete = self.fill[segment:, tiles] >= self.segment_time
+        contiguous = np.cumprod(complete, axis=0).sum(axis=0)
+        played = self.position - (segment - 1) * self.segment_time
+        return np.maximum(contiguous * self.segment_time - played, 0)
+
+    def occupancy(self, tiles=None):
+        """
+        Buffer level of the given tiles, that is the level of the least buffered one.
+        """
+        levels = self.levels(tiles)
+        return float(levels.min()) if levels.size else 0.0
+
+    def play(self, position, tiles):
+        """
+        Moves playback to position (in seconds) with the given tiles in the viewport, updating the stall events.
+        """
+        self.position = position
+        self.viewport = tiles
+        segment = self.current_segment()
+        missing = segment <= self.n_segments and bool(np.any(self.fill[segment, tiles] < self.segment_time))
 
-    def start(self):
-        while not self.finished:
-            if (self.producer_current<=self.consumer_current):
-                #print('Buffer: locked')
-                self.lockings += 1
-                #while (self.producer_current<=self.consumer_current):
-                #    self.timer += 1
+        if missing and not self.stalled:
+            self.stalled = True
+            self.stall_start = position
+        elif not missing and self.stalled:
+            self.stalled = False
+            self.stalls.append((self.stall_start, position - self.stall_start))
+        self._notify()
+
+    def rebuffering_time(self):
+        total = sum(duration for _, duration in self.stalls)
+        if self.stalled:
+            total += self.position - self.stall_start
+        return total
+
+    def stall_count(self):
+        return len(self.stalls) + int(self.stalled)
+
+    async def wait_for(self, predicate):
+        """
+        Returns once predicate(buffer) is true, it is checked again every time the buffer changes.
+        """
+        if predicate(self):
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append((predicate, waiter))
+        await waiter
+
+    async def wait_below(self, level, tiles=None):
+        """
+        Returns once less than level seconds of the tiles are buffered, by default of those of the viewport played.
+        """
+        await self.wait_for(lambda buffer: buffer.finished or
+                            buffer.occupancy(buffer.viewport if tiles is None else tiles) < level)
+
+    def _notify(self):
+        waiting = []
+        for predicate, waiter in self._waiters:
+            if waiter.done():
+                continue
+            if predicate(self):
+                waiter.set_result(None)
             else:
-                self.read()
-                time.sleep(1)
-        print('Buffer finished!')
-                
+                waiting.append((predicate, waiter))
+        self._waiters = waiting
+
+    def finish(self):
+        self.finished = True
+        self._notify()
@@ -0,0 +1,111 @@
+import argparse
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from src.manifest import ManifestIndex, RECORD_DTYPE
+from src.video_constants import SERVER_FILE_LOCATION, BUNDLE_LOCATION
+
+# Bundle files: header (magic, version, segment, bitrate, entries in the index), then the (offset, size) of every tile
+# number from the start of the file (size 0 for the tiles that aren't in it), then the tiles one after the other
+BUNDLE_MAGIC = b'TBND'
+BUNDLE_VERSION = 1
+BUNDLE_HEADER = struct.Struct('<4sHHHL')
+BUNDLE_FILE = 'bundle_{bitrate}_{segment}.bin'
+
+
+def pack_segment(manifest, segment, bitrate, file_name):
+    """
+    Writes the files of every tile of a (segment, bitrate) of the manifest to a single bundle file. Returns its size.
+    """
+    level = manifest.level(bitrate)
+    sizes = manifest.sizes[level, segment]
+    index = np.zeros(len(sizes), dtype=RECORD_DTYPE)
+    index['size'] = sizes
+    index['offset'] = BUNDLE_HEADER.size + index.nbytes + np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    index['offset'][sizes == 0] = 0
+
+    with open(file_name, 'wb') as bundle_file:
+        bundle_file.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, segment, bitrate, len(index)))
+        bundle_file.write(index.tobytes())
+        for tile in np.flatnonzero(sizes):
+            with open(manifest.file_names[level, segment, tile], 'rb') as tile_file:
+                bundle_file.write(tile_file.read())
+        return bundle_file.tell()
+
+def pack_bundles(manifest, location=BUNDLE_LOCATION):
+    """
+    One bundle file per (segment, bitrate) of the manifest, init segments included (segment 0).
+    """
+    os.makedirs(location, exist_ok=True)
+    total = 0
+    for bitrate in manifest.bitrates:
+        for segment in range(manifest.n_segments + 1):
+            file_name = os.path.join(location, BUNDLE_FILE.format(bitrate=bitrate, segment=segment))
+            total += pack_segment(manifest, segment, bitrate, file_name)
+    return total
+
+
+class SegmentBundles:
+    """
+    Every bundle file of a directory memory mapped: a tile is a slice of the map of its (segment, bitrate), found in
+    its index, without a file being opened or the tile copied. Has the interface of SharedSegments, so the segment
+    cache serves tiles from it the same way. The maps are backed by the files, so server workers forked after it is
+    created share the page cache instead of a copy.
+    """
+    def __init__(self, location=BUNDLE_LOCATION):
+        self.size = 0
+        self._bundles = {}  # (segment, bitrate) -> (view of the file, (offset, size) by tile)
+        for name in sorted(os.listdir(location)):
+            with open(os.path.join(location, name), 'rb') as bundle_file:
+                header = bundle_file.read(BUNDLE_HEADER.size)
+                if len(header) < BUNDLE_HEADER.size or not header.startswith(BUNDLE_MAGIC):
+                    continue
+                _, version, segment, bitrate, entries = BUNDLE_HEADER.unpack(header)
+                if version != BUNDLE_VERSION:
+                    raise ValueError('Not a version ' + str(BUNDLE_VERSION) + ' bundle file: ' + name)
+                bundle_map = mmap.mmap(bundle_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+            index = np.frombuffer(bundle_map, dtype=RECORD_DTYPE, count=entries, offset=BUNDLE_HEADER.size).tolist()
+            self._bundles[(segment, bitrate)] = (memoryview(bundle_map), index)
+            self.size += len(bundle_map)
+
+    def __len__(self):
+        return len(self._bundles)
+
+    def get(self, segment, tile, bitrate):
+        bundle = self._bundles.get((int(segment), int(bitrate)))
+        tile = int(tile)
+        if bundle is None or not 0 <= tile < len(bundle[1]):
+            return None
+        view, index = bundle
+        offset, size = index[tile]
+        if size == 0:
+            return None
+        return view[offset:offset + size]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Packs the tiles of every segment and bitrate into bundle files")
+    parser.add_argument(
+        "--segments",
+        type=str,
+        default=SERVER_FILE_LOCATION,
+        help="directory with the MPD and segment files (defaults to data/segments/)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=BUNDLE_LOCATION,
+        help="directory the bundle files are written to (defaults to data/bundles/)",
+    )
+    args = parser.parse_args()
+
+    manifest = ManifestIndex.load(args.segments)
+    total = pack_bundles(manifest, args.output)
+    print("Packed " + str(int(np.count_nonzero(manifest.sizes))) + " files into " +
+          str(len(manifest.bitrates) * (manifest.n_segments + 1)) + " bundles, " + str(total) + " bytes, in " +
+          args.output)
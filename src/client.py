@@ -1,235 +1,267 @@
 import argparse
 import asyncio
-import binascii
-import csv
-import struct
-import datetime
-import timeit
 import time
 import os
 
+import numpy as np
+
 from urllib.parse import urlparse
-from src.dash import Dash
+from src.dash import Dash, ALGORITHMS, TILED, BOLA
 from aioquic.asyncio import QuicConnectionProtocol
 from aioquic.asyncio.client import connect
 from aioquic.quic.configuration import QuicConfiguration
-from src.data_types import VideoPacket, QUICPacket
-from src.utils import message_to_VideoPacket, get_client_file_name, segment_exists
-from src.video_constants import HIGH_PRIORITY, FRAME_TIME_MS, LOW_PRIORITY, VIDEO_FPS, CLIENT_BITRATE, N_SEGMENTS
+from src.codec import LENGTH, encode_hello, read_hello_ack, get_codec, decode_init_bundle
+from src.data_types import VideoPacket, QUICPacket, VideoBatchPacket, PlaybackPosition
+from src.segment_store import create_store, FILE_STORE
+from src.playback import PlaybackClock, VirtualClock
+from src.manifest import ManifestIndex
+from src.measurement import ThroughputMeter
+from src.report import PlaybackReport
+from src.prefetch import PrefetchEngine, HORIZON, PREFETCH_INTERVAL, segment_of
+from src.tile_index import TileIndex, tiles_mask
+from src.viewport import ViewportTrace, complement
+from src.video_constants import HIGH_PRIORITY, FRAME_TIME_MS, LOW_PRIORITY, VIDEO_FPS, CLIENT_BITRATE, N_SEGMENTS, \
+    SEGMENT_TIME, PROTOCOL_TEXT, PROTOCOL_BINARY, SERVER_FILE_LOCATION, INIT_SEGMENT
 from src.buffer import Buffer
-from multiprocessing import Process
 
 CLIENT_ID = '1' 
 
-last_segment = 1
+# Initial size of the buffer tiles are read into, it grows to the largest tile received
+TILE_BUFFER_SIZE = 64 * 1024
 
-async def aioquic_client(ca_cert: str, connection_host: str, connection_port: int, dash: Dash, buffer: Buffer):
+async def aioquic_client(ca_cert: str, connection_host: str, connection_port: int, dash: Dash, buffer: Buffer, store, tile_index: TileIndex, clock: PlaybackClock, prefetch: PrefetchEngine, meter: ThroughputMeter):
     configuration = QuicConfiguration(is_client=True, idle_timeout=5)
     configuration.load_verify_locations(ca_cert)
-    async with connect(connection_host, connection_port, configuration=configuration) as client:
+    codec = get_codec(Protocol_Version)
+
+    # Streams opened by the server only carry tiles
+    def handle_data_stream(reader, writer):
+        asyncio.ensure_future(receive(reader, dash, buffer, store, tile_index, meter, codec, control=False))
+
+    async with connect(connection_host, connection_port, configuration=configuration, stream_handler=handle_data_stream) as client:
         connection_protocol = QuicConnectionProtocol
         reader, writer = await connection_protocol.create_stream(client)
-        await handle_stream(reader, writer, dash, buffer)
-
-async def send_data(writer, stream_id, end_stream, packet=None):
-    data = QUICPacket(stream_id, end_stream, packet).serialize()
+        await handle_stream(reader, writer, dash, buffer, store, tile_index, clock, prefetch, meter, codec)
 
-    writer.write(struct.pack('<L', len(data)))
-    writer.write(data)
+async def send_data(writer, codec, stream_id, end_stream, packet=None):
+    writer.write(codec.frame_request(QUICPacket(stream_id, end_stream, packet)))
 
     await asyncio.sleep(0.0001)
 
-async def handle_stream(reader, writer, dash, buffer: Buffer):
+def segment_bitrate(dash, buffer: Buffer, segment_bitrates, segment, fov_mask):
+    """
+    Bitrate of every tile of the segment, chosen when it is first requested from the FOV expected at that time and
+    how much of the viewport being played is buffered, and the size of its tiles when the manifest is available.
+    """
+    if segment not in segment_bitrates:
+        viewport = buffer.viewport if len(buffer.viewport) else np.flatnonzero(fov_mask)
+        dash.update_buffer_level(buffer.occupancy(viewport))
+        sizes = Manifest.tile_sizes(segment) if Manifest is not None else None
+        segment_bitrates[segment] = dash.get_tile_bitrates(segment, fov_mask, sizes)
+    return segment_bitrates[segment]
+
+async def request_tiles(writer, codec, dash, tile_index: TileIndex, meter: ThroughputMeter, segment, bitrates, high_priority_tiles, low_priority_tiles):
+    high_priority_tiles = np.asarray(high_priority_tiles, dtype=int)
+    low_priority_tiles = np.asarray(low_priority_tiles, dtype=int)
+    tiles = np.concatenate((high_priority_tiles, low_priority_tiles))
+    tile_index.request(segment, tiles, bitrates)
+    # Samples of the segments before are closed with what they got
+    for goodput in meter.request(segment, tiles, bitrates, asyncio.get_event_loop().time()):
+        dash.update_goodput(goodput)
+
+    # Requests carry a single bitrate, tiles are grouped by theirs, FOV first
+    for bitrate in dict.fromkeys(bitrates[tiles].astype(int).tolist()):
+        high_tiles = high_priority_tiles[bitrates[high_priority_tiles] == bitrate].tolist()
+        low_tiles = low_priority_tiles[bitrates[low_priority_tiles] == bitrate].tolist()
+
+        if Batch_Requests and codec.supports_batches:
+            # A SINGLE REQUEST WITH THE TILES IN FOV FIRST, WITH HIGHER PRIORITY
+            message = VideoBatchPacket(segment, bitrate, high_tiles, low_tiles)
+            await send_data(writer, codec, stream_id=CLIENT_ID, end_stream=False, packet=message)
+        else:
+            # SEND REQUEST FOR TILES IN FOV WITH HIGHER PRIORITY
+            for tile in high_tiles:
+                # Smaller the number, bigger the priority
+                message = VideoPacket(segment, tile, HIGH_PRIORITY, bitrate)
+                await send_data(writer, codec, stream_id=CLIENT_ID, end_stream=False, packet=message)
+
+            # REQUESTS FOR THE TILES THAT ARE NOT IN FOV WITH LOWER PRIORITY
+            for tile in low_tiles:
+                message = VideoPacket(segment, tile, LOW_PRIORITY, bitrate)
+                await send_data(writer, codec, stream_id=CLIENT_ID, end_stream=False, packet=message)
+
+async def handle_stream(reader, writer, dash, buffer: Buffer, store, tile_index: TileIndex, clock: PlaybackClock, prefetch: PrefetchEngine, meter: ThroughputMeter, codec):
     # User input
-    asyncio.ensure_future(receive(reader, dash, buffer))
+    asyncio.ensure_future(receive(reader, dash, buffer, store, tile_index, meter, codec))
 
-    # Buffer
-    #Process(target = buffer.start).start()
-    
     # Server data received
-    writer.write(CLIENT_ID.encode())
+    if codec.version == PROTOCOL_TEXT:
+        writer.write(CLIENT_ID.encode())
+    else:
+        writer.write(encode_hello(CLIENT_ID, codec.version, Max_Chunk, Streams))
     await asyncio.sleep(0.0001)
 
-    # List all tiles
-    tiles_list = list(range(1,201))
-    # Total frames
-    total_frames = 0
-    total_frames_fov = 0
-
-    # Missed frames
-    missed_frames = 0
-    missed_frames_fov = 0
-
     # Missing ratio
-    missed_frames_seg = {}
-    total_frames_seg = {}
-    missing_ratio = {}
-    missed_frames_seg_fov = {}
-    total_frames_seg_fov = {}
-    missing_ratio_fov = {}
-    
-
-    # USER INPUT (currently simulated by CSV)
-    with open(User_Input_File) as csv_file:
-        csv_reader = csv.reader(csv_file, delimiter=',')
-        frame = 0
-        video_segment = 0
-        frame_request = 1
-
-        for row in csv_reader:
-            frame_time = datetime.datetime.now()
-            not_in_fov = tiles_list.copy()
-            # Frame to make request
-            if frame == frame_request:
-                video_segment += 1
-                
-                missed_frames_seg[video_segment] = 0
-                total_frames_seg[video_segment] = 0
-                missed_frames_seg_fov[video_segment] = 0
-                total_frames_seg_fov[video_segment] = 0
-
-                current_bitrate = dash.get_next_bitrate(video_segment)
-
-                # SEND REQUEST FOR TILES IN FOV WITH HIGHER PRIORITY
-                index = 0
-                for tile in row:
-                    tile = int(tile)
-                    if index != 0:
-                        if not segment_exists(video_segment, tile, current_bitrate):
-                            # Smaller the number, bigger the priority
-                            message = VideoPacket(video_segment, tile, HIGH_PRIORITY, current_bitrate)
-                            await send_data(writer, stream_id=CLIENT_ID, end_stream=False, packet=message)
-                        not_in_fov.remove(tile)
-                    index += 1
-
-                # REQUESTS FOR THE TILES THAT ARE NOT IN FOV WITH LOWER PRIORITY
-                for tile in not_in_fov:
-                    if not segment_exists(video_segment, tile, current_bitrate):
-                        message = VideoPacket(video_segment, tile, LOW_PRIORITY, current_bitrate)
-                        await send_data(writer, stream_id=CLIENT_ID, end_stream=False, packet=message)
-                frame_request += VIDEO_FPS
-
-                await asyncio.sleep(0.1)
-
-            # CHECK FOR MISSING RATIO
-            if frame != 0:
-                # Wait for the actual time of the frame
-                waiting_for_time = True
-                while waiting_for_time:
-                    time_now = datetime.datetime.now()
-                    delta = time_now - frame_time
-
-                    if delta.microseconds > FRAME_TIME_MS:
-                        waiting_for_time = False
-                        
-                # Check for missing segments
-                index = 0
-                missed_tiles = 0
-                missed_tiles_fov = 0
-                total_tiles = 0
-                total_tiles_fov = 0
-
-                tiles_in_fov = []
-                for t in row:
-                    tile = int(t)
-                    if index != 0:
-                        tiles_in_fov.append(tile)
-                    index+=1
-
-                for tile in tiles_list:
-                    total_tiles+=1
-                    in_row = False
-
-                    if (tile in tiles_in_fov):
-                        total_tiles_fov +=1
-                        in_row = True
-
-                    if not segment_exists(video_segment, tile, current_bitrate):
-                        missed_tiles += 1
-                        if (in_row):
-                            missed_tiles_fov +=1
-                
-                missed_frames += missed_tiles
-                total_frames += total_tiles
-                missed_frames_seg[video_segment] = missed_frames_seg[video_segment] + missed_tiles
-                total_frames_seg[video_segment] = total_frames_seg[video_segment] + total_tiles
-
-                missed_frames_fov += missed_tiles_fov
-                total_frames_fov += total_tiles_fov
-                missed_frames_seg_fov[video_segment] = missed_frames_seg_fov[video_segment] + missed_tiles_fov
-                total_frames_seg_fov[video_segment] = total_frames_seg_fov[video_segment] + total_tiles_fov
-
-                # On last segment, print the results and end connection
-                if frame == (N_SEGMENTS*VIDEO_FPS)+1:
-                    i=1
-                    sum_bitrate = 0
-                    download_time_seg = {}
-                    while (i<=N_SEGMENTS):
-                        missing_ratio[i] = str(round((missed_frames_seg[i]/total_frames_seg[i])*100, 2))+"%"
-                        missing_ratio_fov[i] = str(round((missed_frames_seg_fov[i]/total_frames_seg_fov[i])*100, 2))+'%'
-
-                        sum_bitrate += dash.bitrates_seg[i]
-                        try:
-                            download_time_seg[i] = str(round(dash.previous_segment_times_seg[i], 2))+'s'
-                        except:
-                            download_time_seg[i] = 'NOT_FINISHED'
-
-                        i+=1
-
-                    missing_ratio_total = round((missed_frames/total_frames)*100, 2)
-                    missing_ratio_total_fov = round((missed_frames_fov/total_frames_fov)*100, 2)
-
-                    buffer.finish()
-
-                    print("Missing ratio total: "+str(missing_ratio_total)+"%")
-                    print("Missing ratio total (campo visão): "+str(missing_ratio_total_fov)+"%")
-                    print("Missing ratio por segmento: "+str(missing_ratio))
-                    print("Missing ratio por segmento (campo visão): "+str(missing_ratio_fov))
-                    print("Tempo total de download: "+str(round(sum(dash.previous_segment_times), 2))+"s")
-                    print("Tempo total de download por segmento: "+str(download_time_seg))
-                    print("Bitrate médio: "+str(round(sum_bitrate / N_SEGMENTS, 2)))
-                    print("Bitrate por segmento: "+str(dash.bitrates_seg))
-                    await send_data(writer, stream_id=CLIENT_ID, end_stream=True)
-                    return
-
-            frame += 1
-
-async def receive(reader, dash, buffer):
-    global last_segment
+    report = PlaybackReport(N_SEGMENTS)
+
+    # USER INPUT (currently simulated by CSV, parsed once)
+    video_segment = 0
+    frame_request = 1
+    # Bitrate of each segment, chosen when it is first requested
+    segment_bitrates = {}
+
+    clock.start()
+    if prefetch.horizon > 0:
+        asyncio.ensure_future(prefetch_tiles(writer, codec, dash, buffer, tile_index, meter, prefetch,
+                                             segment_bitrates))
+
+    for frame in range(len(Viewports) + 1):
+        if frame != 0:
+            tiles_in_fov = Viewports.tiles[frame]
+            fov_mask = Viewports.masks[frame]
+            prefetch.observe(frame, tiles_in_fov)
+
+        # Frame to make request
+        if frame == frame_request:
+            video_segment += 1
+
+            current_bitrate = segment_bitrate(dash, buffer, segment_bitrates, video_segment, fov_mask)
+            # Tiles of the FOV the prediction missed are fetched at least at the lowest bitrate
+            current_bitrate[fov_mask & (current_bitrate == 0)] = dash.bitrates[0]
+
+            # Tiles already prefetched are on their way
+            missing = tile_index.unrequested(video_segment, current_bitrate)
+
+            if codec.supports_positions:
+                # Lets the server compute the playout deadline of the tiles
+                await send_data(writer, codec, stream_id=CLIENT_ID, end_stream=False,
+                                packet=PlaybackPosition(frame, clock.fps))
+
+            high_priority_tiles = np.flatnonzero(missing & fov_mask).tolist()
+            low_priority_tiles = np.flatnonzero(missing & complement(fov_mask)).tolist()
+            await request_tiles(writer, codec, dash, tile_index, meter, video_segment, current_bitrate, high_priority_tiles,
+                                low_priority_tiles)
+            frame_request += VIDEO_FPS
+
+        # CHECK FOR MISSING RATIO
+        if frame != 0:
+            # Tiles coming into view that were left out of the segment are fetched at the lowest bitrate
+            skipped = fov_mask & (current_bitrate == 0)
+            if skipped.any():
+                current_bitrate[skipped] = dash.bitrates[0]
+                await request_tiles(writer, codec, dash, tile_index, meter, video_segment, current_bitrate,
+                                    np.flatnonzero(skipped).tolist(), [])
+
+            # Wait for the actual time of the frame
+            await clock.wait_frame(frame)
+            buffer.play((frame - 1) / VIDEO_FPS, tiles_in_fov)
+
+            # Check for missing segments
+            report.add_frame(video_segment, tile_index.missing(video_segment, current_bitrate), fov_mask)
+
+            # On last segment, print the results and end connection
+            if frame == (N_SEGMENTS*VIDEO_FPS)+1:
+                buffer.finish()
+                report.print(dash, buffer, meter, clock, prefetch)
+                if Measurements_File:
+                    meter.export(Measurements_File)
+                await send_data(writer, codec, stream_id=CLIENT_ID, end_stream=True)
+                return
+
+async def prefetch_tiles(writer, codec, dash, buffer: Buffer, tile_index: TileIndex, meter: ThroughputMeter, prefetch: PrefetchEngine, segment_bitrates):
+    """
+    Requests the predicted FOV of the next segments whenever less than the prefetch horizon of the viewport is
+    buffered, the prediction being refreshed at most every PREFETCH_INTERVAL frames played.
+    """
+    position = 0.0
+    while not buffer.finished:
+        await buffer.wait_for(lambda buffer: buffer.finished or buffer.position >= position)
+        await buffer.wait_below(prefetch.horizon * SEGMENT_TIME)
+        if buffer.finished:
+            return
+
+        frame = prefetch.frame
+        for segment in prefetch.segments_ahead(segment_of(frame)):
+            predicted = tiles_mask(prefetch.predict(frame, segment))
+            bitrate = segment_bitrate(dash, buffer, segment_bitrates, segment, predicted)
+            predicted_tiles = np.flatnonzero(predicted & tile_index.unrequested(segment, bitrate)).tolist()
+            if predicted_tiles:
+                await request_tiles(writer, codec, dash, tile_index, meter, segment, bitrate, predicted_tiles, [])
+        position = buffer.position + PREFETCH_INTERVAL / VIDEO_FPS
+
+async def read_tile(reader, tile_buffer: bytearray, size_hint=0):
+    """
+    Reads the length prefixed chunks of a tile into tile_buffer, growing it only when the tile doesn't fit, and
+    returns a memoryview over the payload (which must be released before the next call).
+    """
+    if size_hint > len(tile_buffer):
+        tile_buffer.extend(bytes(size_hint - len(tile_buffer)))
+
+    offset = 0
+    while True:
+        chunk_size, = LENGTH.unpack(await reader.readexactly(4))
+        if chunk_size == 0:
+            return memoryview(tile_buffer)[:offset]
+
+        end = offset + chunk_size
+        if end > len(tile_buffer):
+            tile_buffer.extend(bytes(end - len(tile_buffer)))
+        tile_buffer[offset:end] = await reader.readexactly(chunk_size)
+        offset = end
+
+async def receive(reader, dash, buffer, store, tile_index: TileIndex, meter: ThroughputMeter, codec, control=True):
+    if control and codec.version != PROTOCOL_TEXT:
+        version, chunk_size, streams = await read_hello_ack(reader)
+        if version != codec.version:
+            raise ValueError('Server answered with protocol '+str(version)+' instead of '+str(codec.version))
+
+    # Data streams may only carry a single tile, their buffer is sized by the first one
+    tile_buffer = bytearray(TILE_BUFFER_SIZE if control else 0)
+
+    loop = asyncio.get_event_loop()
     while True:
-        start_time = timeit.default_timer()
         try:
-            size, = struct.unpack('<L', await reader.readexactly(4))
+            size, = LENGTH.unpack(await reader.readexactly(4))
         except:
             finished = True
             break
-            
-        dash.append_download_size(size)
+        # The tile is timed from its first byte, waiting for it is idle time
+        first_byte = loop.time()
 
         file_name_data = await reader.readexactly(size)
-        file_info = message_to_VideoPacket(eval(file_name_data.decode()))
-
-        if (int(file_info.segment)!=last_segment):
-            buffer.write()
-
-        file_name = get_client_file_name(segment=file_info.segment, tile=file_info.tile, bitrate=file_info.bitrate)
-        with open(file_name, "wb") as newFile:
-            not_finished = True
-            while not_finished:
-                try:
-                    file_size, = struct.unpack('<L', await reader.readexactly(4))
-                    if file_size == 0:
-                        not_finished = False
-                    else:
-                        chunk = await reader.readexactly(file_size)
-                        newFile.write(binascii.hexlify(chunk))
-                except:
-                    break
-    
+        file_info = codec.decode_header(file_name_data)
 
-        last_segment = file_info.segment
-
-        dash.update_download_time(timeit.default_timer() - start_time, int(file_info.segment))
+        try:
+            payload = await read_tile(reader, tile_buffer, file_info.size or 0)
+        except asyncio.IncompleteReadError:
+            break
+        last_byte = loop.time()
+        payload_size = len(payload)
+
+        # Init segments of the tiles about to be received, bundled by the server (tile 0) or one by one with the text
+        # protocol, they aren't part of the playback
+        if int(file_info.segment) == INIT_SEGMENT:
+            if int(file_info.tile) == 0:
+                for tile, data in decode_init_bundle(payload):
+                    store.put(INIT_SEGMENT, tile, file_info.bitrate, data)
+                    data.release()
+            else:
+                store.put(INIT_SEGMENT, file_info.tile, file_info.bitrate, payload)
+            payload.release()
+            continue
+
+        store.put(file_info.segment, file_info.tile, file_info.bitrate, payload)
+        tile_index.add(file_info.segment, file_info.tile, file_info.bitrate)
+        buffer.write(file_info.segment, file_info.tile)
+        payload.release()
+
+        segment = int(file_info.segment)
+        dash.append_download_size(payload_size)
+        dash.update_download_time(last_byte - first_byte, segment)
+        goodput = meter.record(segment, int(file_info.tile), float(file_info.bitrate), first_byte, last_byte,
+                               payload_size)
+        if goodput is not None:
+            dash.update_goodput(goodput)
     
 
 if __name__ == "__main__":
@@ -251,7 +283,13 @@ if __name__ == "__main__":
         "--user-input",
         required=True,
         type=str,
-        help="CSV file with user input simulation",
+        help="CSV file with user input simulation, or binary trace file written by src.viewport",
+    )
+    parser.add_argument(
+        "--user",
+        type=int,
+        default=0,
+        help="user replayed from a binary trace file (defaults to 0)",
     )
     parser.add_argument(
         "-da",
@@ -259,13 +297,110 @@ if __name__ == "__main__":
         required=False,
         default="basic",
         type=str,
-        help="dash algorithm (options: basic, basic2) - (defaults to basic)",
+        help="dash algorithm (options: "+", ".join(ALGORITHMS)+", "+TILED+" = a bitrate per tile, weighted by the viewport, "
+             +BOLA+" only with a --horizon) - (defaults to basic)",
+    )
+    parser.add_argument(
+        "-p",
+        "--protocol",
+        required=False,
+        default=PROTOCOL_BINARY,
+        type=int,
+        help="wire protocol version (options: 0 = text, 1 = binary) - (defaults to 1)",
+    )
+    parser.add_argument(
+        "--max-chunk",
+        required=False,
+        default=0,
+        type=int,
+        help="largest chunk the server may send, 0 accepts whole tiles in a single chunk (defaults to 0)",
+    )
+    parser.add_argument(
+        "-r",
+        "--requests",
+        required=False,
+        default="batch",
+        type=str,
+        help="how tiles are requested (options: tile = one request per tile, batch = one request per segment, only "
+             "with the binary protocol) - (defaults to batch)",
+    )
+    parser.add_argument(
+        "--streams",
+        required=False,
+        default=1,
+        type=int,
+        help="data streams the server should use: 1 = only the request stream, 0 = a new stream per tile, N = a pool "
+             "of N streams split between FOV and other tiles, only with the binary protocol - (defaults to 1)",
+    )
+    parser.add_argument(
+        "-s",
+        "--store",
+        required=False,
+        default=FILE_STORE,
+        type=str,
+        help="where received tiles are kept (options: file, memory, ring) - (defaults to file)",
+    )
+    parser.add_argument(
+        "--store-mb",
+        required=False,
+        default=64,
+        type=int,
+        help="size in MB of the memory and ring stores (defaults to 64)",
+    )
+    parser.add_argument(
+        "--horizon",
+        required=False,
+        default=HORIZON,
+        type=int,
+        help="segments ahead of playback whose predicted FOV tiles are prefetched (defaults to 0)",
+    )
+    parser.add_argument(
+        "--measurements",
+        required=False,
+        type=str,
+        help="CSV file the first and last byte times and payload bytes of every tile are written to at the end",
+    )
+    parser.add_argument(
+        "--speed",
+        required=False,
+        default=1.0,
+        type=float,
+        help="playback speed relative to real time (defaults to 1.0)",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=SERVER_FILE_LOCATION,
+        help="directory with the MPD files giving the tile sizes to -da tiled (defaults to data/segments/)",
+    )
+    parser.add_argument(
+        "--virtual-time",
+        action="store_true",
+        help="play the user input as fast as possible, without waiting for the frame times",
     )
 
     args = parser.parse_args()
 
-    global User_Input_File
-    User_Input_File = args.user_input
+    global Viewports
+    Viewports = ViewportTrace.read(args.user_input, args.user)
+
+    global Protocol_Version
+    Protocol_Version = args.protocol
+
+    global Max_Chunk
+    Max_Chunk = args.max_chunk
+
+    global Batch_Requests
+    Batch_Requests = args.requests == "batch"
+
+    global Streams
+    Streams = args.streams
+
+    global Measurements_File
+    Measurements_File = args.measurements
+
+    global Manifest
+    Manifest = ManifestIndex.load(args.manifest) if os.path.isdir(args.manifest) else None
 
     parsed = urlparse(args.url)
     host = parsed.hostname
@@ -275,10 +410,25 @@ if __name__ == "__main__":
     else:
         port = 4433
 
-    dash = Dash([1, 2, 5], args.dash_algorithm)
+    if args.dash_algorithm == BOLA and args.horizon <= 0:
+        parser.error("-da " + BOLA + " adapts to the buffer ahead of playback, which needs a --horizon")
+    dash = Dash([1, 2, 5], args.dash_algorithm, args.horizon * SEGMENT_TIME)
+
+    tile_index = TileIndex(dash.bitrates)
+
+    if args.virtual_time:
+        clock = VirtualClock(FRAME_TIME_MS / 1000000)
+    else:
+        clock = PlaybackClock(FRAME_TIME_MS / 1000000, args.speed)
+
+    buffer = Buffer(N_SEGMENTS, SEGMENT_TIME)
 
-    buffer = Buffer(N_SEGMENTS, VIDEO_FPS)
+    prefetch = PrefetchEngine(args.horizon)
+
+    meter = ThroughputMeter()
 
     os.system("rm data/client_files/*")
 
-    asyncio.get_event_loop().run_until_complete(aioquic_client(ca_cert=args.ca_certs, connection_host=host, connection_port=port, dash=dash, buffer=buffer))
\ No newline at end of file
+    store = create_store(args.store, args.store_mb * 1024 * 1024)
+
+    asyncio.get_event_loop().run_until_complete(aioquic_client(ca_cert=args.ca_certs, connection_host=host, connection_port=port, dash=dash, buffer=buffer, store=store, tile_index=tile_index, clock=clock, prefetch=prefetch, meter=meter))
\ No newline at end of file
@@ -0,0 +1,216 @@
+import ast
+import struct
+
+from src.data_types import QUICPacket, VideoPacket, VideoBatchPacket, PlaybackPosition
+from src.utils import message_to_QUICPacket, message_to_VideoPacket
+from src.video_constants import MAX_TILE, HELLO_MARKER, PROTOCOL_TEXT, PROTOCOL_BINARY, SUPPORTED_PROTOCOLS
+
+# Every message on the stream is preceded by its length
+LENGTH = struct.Struct('<L')
+
+# Hello sent by versioned clients: marker, protocol version, largest chunk accepted (0 = whole tile), data streams
+# wanted (see negotiate_streams), client id length (followed by the id)
+HELLO = struct.Struct('<BBLBB')
+# Answer from the server: marker, protocol version, chunk size (0 = whole tile) and data streams used for the rest of
+# the session
+HELLO_ACK = struct.Struct('<BBLB')
+
+# Binary message kinds
+MSG_TILE = 1
+MSG_CLOSE = 2
+MSG_BATCH = 3
+MSG_POSITION = 4
+
+# Binary layouts: kind, stream id, segment, tile, priority, bitrate
+REQUEST = struct.Struct('<BHHHBB')
+FRAMED_REQUEST = struct.Struct('<L' + REQUEST.format[1:])
+# Binary layouts: kind, stream id, segment, bitrate, number of high priority tiles, number of tiles (followed by the
+# tile numbers, high priority ones first)
+BATCH = struct.Struct('<BHHBHH')
+TILE_LIST = struct.Struct('<H')
+# Binary layouts: kind, stream id, frame being played, frames played per second
+POSITION = struct.Struct('<BHLf')
+FRAMED_POSITION = struct.Struct('<L' + POSITION.format[1:])
+# Binary layouts: segment, tile, priority, bitrate, payload size
+HEADER = struct.Struct('<HHBBL')
+FRAMED_HEADER = struct.Struct('<L' + HEADER.format[1:])
+# Payload of an init bundle (segment INIT_SEGMENT, tile 0): for every tile, tile and size, followed by its init segment
+INIT_ENTRY = struct.Struct('<HL')
+
+
+def encode_init_bundle(init_segments):
+    """
+    Payload of an init bundle from (tile, init segment data) pairs.
+    """
+    bundle = bytearray()
+    for tile, data in init_segments:
+        bundle += INIT_ENTRY.pack(int(tile), len(data))
+        bundle += data
+    return bundle
+
+def decode_init_bundle(payload):
+    """
+    (tile, init segment data) pairs of an init bundle, the data being views of payload.
+    """
+    payload = memoryview(payload)
+    offset = 0
+    while offset < len(payload):
+        tile, size = INIT_ENTRY.unpack_from(payload, offset)
+        offset += INIT_ENTRY.size
+        yield tile, payload[offset:offset + size]
+        offset += size
+
+def encode_hello(client_id, version, max_chunk=0, streams=1):
+    client_id = client_id.encode()
+    return HELLO.pack(HELLO_MARKER, version, max_chunk, streams, len(client_id)) + client_id
+
+async def read_hello(reader):
+    """
+    Reads the first message of a stream and returns (client id, protocol version, largest chunk accepted, data
+    streams wanted).
+
+    Legacy clients only send their id as plain text, so anything not starting with the hello marker is treated as
+    a text protocol session, which reads chunks of any size on a single stream.
+    """
+    first = await reader.readexactly(1)
+    if first[0] != HELLO_MARKER:
+        return (first + await reader.read(1023)).decode(), PROTOCOL_TEXT, 0, 1
+
+    _, version, max_chunk, streams, id_length = HELLO.unpack(first + await reader.readexactly(HELLO.size - 1))
+    client_id = await reader.readexactly(id_length)
+    if version not in SUPPORTED_PROTOCOLS:
+        raise ValueError('Unsupported protocol version: ' + str(version))
+
+    return client_id.decode(), version, max_chunk, streams
+
+def negotiate_chunk_size(server_chunk, client_chunk):
+    """
+    Chunk sizes of 0 mean the whole tile goes in a single chunk, so the smallest non zero size wins.
+    """
+    if server_chunk == 0 or client_chunk == 0:
+        return max(server_chunk, client_chunk)
+    return min(server_chunk, client_chunk)
+
+def encode_hello_ack(version, chunk_size, streams):
+    return HELLO_ACK.pack(HELLO_MARKER, version, chunk_size, streams)
+
+async def read_hello_ack(reader):
+    """
+    Returns (protocol version, chunk size, data streams) chosen by the server.
+    """
+    marker, version, chunk_size, streams = HELLO_ACK.unpack(await reader.readexactly(HELLO_ACK.size))
+    if marker != HELLO_MARKER:
+        raise ValueError('Invalid hello answer from server')
+    return version, chunk_size, streams
+
+
+class TextCodec:
+    """
+    Original encoding: python list literals, kept for clients that don't send a versioned hello.
+    """
+    version = PROTOCOL_TEXT
+    supports_batches = False
+    supports_positions = False
+
+    def frame_request(self, packet: QUICPacket):
+        data = packet.serialize()
+        return LENGTH.pack(len(data)) + data
+
+    def decode_request(self, data):
+        return message_to_QUICPacket(ast.literal_eval(bytes(data).decode()))
+
+    def frame_header(self, packet: VideoPacket):
+        data = packet.serialize()
+        return LENGTH.pack(len(data)) + data
+
+    def decode_header(self, data):
+        return message_to_VideoPacket(ast.literal_eval(bytes(data).decode()))
+
+
+class BinaryCodec:
+    """
+    Fixed layout encoding. Frames are packed into buffers preallocated per codec instance, so the returned frame is
+    only valid until the next call (writers copy the data into the stream buffer right away).
+    """
+    version = PROTOCOL_BINARY
+    supports_batches = True
+    supports_positions = True
+
+    def __init__(self):
+        self._request_buffer = bytearray(FRAMED_REQUEST.size)
+        self._position_buffer = bytearray(FRAMED_POSITION.size)
+        self._header_buffer = bytearray(FRAMED_HEADER.size)
+        self._batch_buffer = bytearray(LENGTH.size + BATCH.size + TILE_LIST.size * MAX_TILE)
+
+    def frame_request(self, packet: QUICPacket):
+        if isinstance(packet.video_packet, VideoBatchPacket):
+            return self.frame_batch(packet)
+        if isinstance(packet.video_packet, PlaybackPosition):
+            return self.frame_position(packet)
+        if packet.end_stream:
+            FRAMED_REQUEST.pack_into(self._request_buffer, 0, REQUEST.size, MSG_CLOSE, int(packet.stream_id), 0, 0, 0, 0)
+        else:
+            video = packet.video_packet
+            FRAMED_REQUEST.pack_into(self._request_buffer, 0, REQUEST.size, MSG_TILE, int(packet.stream_id),
+                                     int(video.segment), int(video.tile), int(video.priority), int(video.bitrate))
+        return self._request_buffer
+
+    def frame_batch(self, packet: QUICPacket):
+        batch = packet.video_packet
+        tiles = batch.high_priority_tiles + batch.low_priority_tiles
+        size = BATCH.size + TILE_LIST.size * len(tiles)
+        if len(self._batch_buffer) < LENGTH.size + size:
+            self._batch_buffer = bytearray(LENGTH.size + size)
+
+        LENGTH.pack_into(self._batch_buffer, 0, size)
+        BATCH.pack_into(self._batch_buffer, LENGTH.size, MSG_BATCH, int(packet.stream_id), int(batch.segment),
+                        int(batch.bitrate), len(batch.high_priority_tiles), len(tiles))
+        struct.pack_into('<' + 'H' * len(tiles), self._batch_buffer, LENGTH.size + BATCH.size, *tiles)
+        return memoryview(self._batch_buffer)[:LENGTH.size + size]
+
+    def frame_position(self, packet: QUICPacket):
+        position = packet.video_packet
+        FRAMED_POSITION.pack_into(self._position_buffer, 0, POSITION.size, MSG_POSITION, int(packet.stream_id),
+                                  int(position.frame), float(position.fps))
+        return self._position_buffer
+
+    def decode_request(self, data):
+        if data[0] == MSG_BATCH:
+            return self.decode_batch(data)
+        if data[0] == MSG_POSITION:
+            _, stream_id, frame, fps = POSITION.unpack_from(data)
+            return QUICPacket(stream_id=stream_id, end_stream=False, video_packet=PlaybackPosition(frame, fps))
+
+        kind, stream_id, segment, tile, priority, bitrate = REQUEST.unpack_from(data)
+        if kind == MSG_CLOSE:
+            return QUICPacket(stream_id=stream_id, end_stream=True)
+        if kind != MSG_TILE:
+            raise ValueError('Unknown message kind: ' + str(kind))
+
+        return QUICPacket(stream_id=stream_id, end_stream=False,
+                          video_packet=VideoPacket(segment=segment, tile=tile, priority=priority, bitrate=bitrate))
+
+    def decode_batch(self, data):
+        _, stream_id, segment, bitrate, n_high, n_tiles = BATCH.unpack_from(data)
+        tiles = list(struct.unpack_from('<' + 'H' * n_tiles, data, BATCH.size))
+        batch = VideoBatchPacket(segment=segment, bitrate=bitrate, high_priority_tiles=tiles[:n_high],
+                                 low_priority_tiles=tiles[n_high:])
+        return QUICPacket(stream_id=stream_id, end_stream=False, video_packet=batch)
+
+    def frame_header(self, packet: VideoPacket):
+        FRAMED_HEADER.pack_into(self._header_buffer, 0, HEADER.size, int(packet.segment), int(packet.tile),
+                                int(packet.priority), int(packet.bitrate), packet.size or 0)
+        return self._header_buffer
+
+    def decode_header(self, data):
+        segment, tile, priority, bitrate, size = HEADER.unpack_from(data)
+        return VideoPacket(segment=segment, tile=tile, priority=priority, bitrate=bitrate, size=size)
+
+
+def get_codec(version):
+    if version == PROTOCOL_BINARY:
+        return BinaryCodec()
+    elif version == PROTOCOL_TEXT:
+        return TextCodec()
+    else:
+        raise ValueError('Unsupported protocol version: ' + str(version))
@@ -1,23 +1,133 @@
+import functools
+import itertools
+import math
+from collections import deque
+
+import numpy as np
+
+from src.measurement import ThroughputEstimator
+from src.video_constants import GRID_ROWS, GRID_COLS, SEGMENT_TIME
+from src.viewport import margin
+
+BASIC = 'basic'
+BASIC2 = 'basic2'
+BOLA = 'bola'
+MPC = 'mpc'
+TILED = 'tiled'
+
+
 # Constants for the BASIC-2 adaptation scheme
 BASIC_THRESHOLD = 10
 BASIC_UPPER_THRESHOLD = 1.2
 BASIC_DELTA_COUNT = 5
 
+# Constants for the TILED adaptation scheme: weight of a tile in the FOV, next to it and elsewhere, and the share of
+# the estimated throughput spent on a segment
+FOV_WEIGHT = 1.0
+MARGIN_WEIGHT = 0.5
+BACKGROUND_WEIGHT = 0.1
+TILED_SAFETY = 0.9
+
+# Constants for the BOLA adaptation scheme: share of the buffer the client can fill below which the lowest bitrate is
+# chosen, and from which the highest is
+BOLA_MIN_BUFFER = 0.3
+BOLA_BUFFER_TARGET = 0.9
+
+# Constants for the MPC adaptation scheme: segments looked ahead, QoE penalties (per Mbps of bitrate change and per
+# second of rebuffering) and the grid of (buffer level, throughput) its decisions are computed for
+MPC_HORIZON = 5
+MPC_SWITCH_PENALTY = 1.0
+MPC_REBUFFER_PENALTY = 5.0
+MPC_BUFFER_STEP = 0.25
+MPC_MAX_BUFFER = 6.0
+MPC_THROUGHPUTS = np.geomspace(0.1, 50, 48)
+
+# Adaptation schemes choosing a bitrate per segment, by name
+ALGORITHMS = {}
+
+def algorithm(name):
+    def register(method):
+        ALGORITHMS[name] = method
+        return method
+    return register
+
+
+class FastMPC:
+    """
+    Model predictive control over the next segments: the sequence of bitrates maximising the QoE (bitrates minus
+    switches minus rebuffering) if the throughput stays as estimated, of which the first bitrate is used.
+
+    Every sequence is simulated once, for a grid of buffer levels, throughputs and previous bitrates, when the
+    object is created, so a decision is a lookup in that table.
+    """
+    def __init__(self, bitrates, horizon=MPC_HORIZON, segment_time=SEGMENT_TIME):
+        self.bitrates = np.array(sorted(float(i) for i in bitrates))
+        self.buffer_levels = np.arange(0, MPC_MAX_BUFFER + MPC_BUFFER_STEP / 2, MPC_BUFFER_STEP)
+        self.throughputs = MPC_THROUGHPUTS
+
+        plans = np.array(list(itertools.product(range(len(self.bitrates)), repeat=horizon)))
+        # Axes: buffer level, throughput, previous bitrate, plan
+        buffer = self.buffer_levels[:, None, None, None]
+        throughput = self.throughputs[None, :, None, None]
+        previous = self.bitrates[None, None, :, None]
+        qoe = 0
+        for step in range(horizon):
+            bitrate = self.bitrates[plans[:, step]]
+            download = bitrate * segment_time / throughput
+            rebuffer = np.maximum(download - buffer, 0)
+            buffer = np.maximum(buffer - download, 0) + segment_time
+            qoe = qoe + bitrate - MPC_SWITCH_PENALTY * np.abs(bitrate - previous) - MPC_REBUFFER_PENALTY * rebuffer
+            previous = bitrate
+        self.table = plans[np.argmax(qoe, axis=-1), 0]
+
+    def decide(self, buffer_level, throughput, previous_bitrate):
+        """
+        Bitrate to download next.
+        """
+        buffer_index = min(int(round(buffer_level / MPC_BUFFER_STEP)), len(self.buffer_levels) - 1)
+        throughput_index = int(np.abs(np.log(self.throughputs) - math.log(throughput)).argmin())
+        previous_index = int(np.abs(self.bitrates - previous_bitrate).argmin())
+        return self.bitrates[self.table[max(buffer_index, 0), throughput_index, previous_index]]
+
+
+@functools.lru_cache(maxsize=None)
+def fast_mpc(bitrates):
+    """
+    Decision table for a bitrate ladder (a tuple), shared by the Dash objects of a process.
+    """
+    return FastMPC(bitrates)
+
+
 class Dash():
-    def __init__(self, bitrates, algorithm):
+    def __init__(self, bitrates, algorithm, max_buffer=0.0):
+        """
+        max_buffer is the most seconds of video the client buffers ahead of playback, which the buffer based
+        algorithms adapt to.
+        """
+        if algorithm == BOLA and max_buffer <= 0:
+            raise ValueError("The " + BOLA + " algorithm needs the client to buffer segments ahead of playback")
         self.algorithm = algorithm
+        self.max_buffer = max_buffer
         self.bitrates = bitrates
         self.current_bitrate = bitrates[0]
         self.average_dwn_time = 0.0
         self.segment_download_time = 0
-        self.recent_download_sizes = []
-        self.previous_segment_times = []
+        self.recent_download_sizes = deque(maxlen=BASIC_DELTA_COUNT)
+        self.previous_segment_times = deque(maxlen=BASIC_DELTA_COUNT)
         self.previous_segment_times_seg = {}
         self.bitrates_seg = {}
+        self.total_download_size = 0
+        self.total_download_time = 0.0
+        self.download_count = 0
+        self.buffer_level = 0.0
+        self.estimator = ThroughputEstimator()
+        self.mpc = fast_mpc(tuple(bitrates)) if algorithm == MPC else None
     
     def update_download_time(self, frame_download_time, segment):
         self.segment_download_time = frame_download_time
         self.previous_segment_times.append(frame_download_time)
+        self.total_download_time += frame_download_time
+        self.download_count += 1
 
         try:
             self.previous_segment_times_seg[segment] = self.previous_segment_times_seg[segment] + frame_download_time
@@ -27,15 +137,73 @@ class Dash():
 
     def append_download_size(self, download_size):
         self.recent_download_sizes.append(download_size)
+        self.total_download_size += download_size
+
+    def update_goodput(self, goodput):
+        """
+        Goodput in Mbps measured over the download of a segment.
+        """
+        self.estimator.add(goodput)
+
+    def update_buffer_level(self, buffer_level):
+        """
+        Seconds of video buffered ahead of playback when the next bitrate is chosen.
+        """
+        self.buffer_level = buffer_level
 
     def get_next_bitrate(self, segment_number):
-        if (self.algorithm=='basic2'):
-            return self.basic_dash2(segment_number)
-        elif (self.algorithm=='basic'):
-            return self.basic_dash(segment_number)
+        if self.algorithm in ALGORITHMS:
+            return ALGORITHMS[self.algorithm](self, segment_number)
         else:
             return self.current_bitrate
 
+    def get_tile_bitrates(self, segment_number, fov_mask, sizes=None):
+        """
+        Bitrate of every tile of the segment, as an array over tile numbers (0 = tile not fetched). Only the tiled
+        algorithm gives the tiles different bitrates, the others one for the whole segment.
+
+        sizes are the bytes of each (tile, bitrate) when they are known, otherwise the bitrate is split evenly
+        between the tiles.
+        """
+        fov_mask = np.asarray(fov_mask, dtype=bool)
+        if self.algorithm != TILED:
+            bitrates = np.full(len(fov_mask), self.get_next_bitrate(segment_number), dtype=float)
+            bitrates[0] = 0
+            return bitrates
+        return self.tiled_dash(segment_number, fov_mask, sizes)
+
+    def throughput(self):
+        """
+        Throughput of the last downloads in Mbps, None before the first one.
+        """
+        return self.estimator.estimate()
+
+    def tiled_dash(self, segment_number, fov_mask, sizes=None):
+        bitrates = np.array(sorted(float(i) for i in self.bitrates))
+
+        weights = np.where(fov_mask, FOV_WEIGHT, np.where(margin(fov_mask), MARGIN_WEIGHT, BACKGROUND_WEIGHT))[1:]
+
+        # Megabits of each tile at each bitrate
+        if sizes is None:
+            costs = np.broadcast_to(bitrates * SEGMENT_TIME / (GRID_ROWS * GRID_COLS), (len(weights), len(bitrates)))
+        else:
+            costs = np.asarray(sizes, dtype=float)[1:] * 8 / 1000000
+
+        # Until something was downloaded the whole segment fits at the lowest bitrate
+        throughput = self.throughput()
+        budget = bitrates[0] * SEGMENT_TIME if throughput is None else throughput * SEGMENT_TIME * TILED_SAFETY
+
+        levels = select_tile_bitrates(weights, costs, bitrates, budget, fov_mask[1:])
+        tile_bitrates = np.zeros(len(fov_mask))
+        tile_bitrates[1:] = np.where(levels >= 0, bitrates[np.maximum(levels, 0)], 0)
+
+        in_fov = tile_bitrates[fov_mask]
+        next_rate = round(float(in_fov.mean()), 2) if in_fov.size else bitrates[0]
+        self.bitrates_seg[segment_number] = next_rate
+        self.current_bitrate = next_rate
+        return tile_bitrates
+
+    @algorithm(BASIC)
     def basic_dash(self, segment_number):
         if self.average_dwn_time > 0 and segment_number > 0:
             updated_dwn_time = (self.average_dwn_time * (segment_number + 1) + self.segment_download_time) / (segment_number + 1)
@@ -84,27 +252,19 @@ class Dash():
         return next_rate
 
     
+    @algorithm(BASIC2)
     def basic_dash2(self, segment_number):
 
-        # Truncating the list of download times and segment 
-        pst = self.previous_segment_times.copy()
-        while len(pst) > BASIC_DELTA_COUNT:
-            pst.pop(0)
-        
-        rds = self.recent_download_sizes.copy()
-        while len(rds) > BASIC_DELTA_COUNT:
-            rds.pop(0)
-
-        if len(pst) == 0 or len(rds) == 0:
+        if self.download_count == 0 or not self.recent_download_sizes:
             self.bitrates_seg[segment_number] = self.bitrates[0]
             self.average_dwn_time = None
             self.current_bitrate = self.bitrates[0]
             return self.bitrates[0]
 
-        updated_dwn_time = sum(self.previous_segment_times) / len(self.previous_segment_times)
+        updated_dwn_time = self.total_download_time / self.download_count
 
         # Calculate the running download_rate in Kbps for the most recent segments
-        download_rate = sum(self.recent_download_sizes) * 8 / (updated_dwn_time * len(self.previous_segment_times))
+        download_rate = self.total_download_size * 8 / (updated_dwn_time * self.download_count)
         bitrates = [float(i) for i in self.bitrates]
         bitrates.sort()
         next_rate = bitrates[0]
@@ -134,4 +294,59 @@ class Dash():
         self.bitrates_seg[segment_number] = next_rate
         self.average_dwn_time = updated_dwn_time
         self.current_bitrate = next_rate
-        return next_rate
\ No newline at end of file
+        return next_rate
+
+    @algorithm(BOLA)
+    def bola(self, segment_number):
+        """
+        Buffer based: the bitrate maximising (V * (utility + gp) - buffer level) / size, the utility of a bitrate
+        being the log of its ratio to the lowest. V and gp are set so that the lowest bitrate is chosen below
+        BOLA_MIN_BUFFER and the highest from BOLA_BUFFER_TARGET of the buffer the client can fill.
+        """
+        bitrates = np.array(sorted(float(i) for i in self.bitrates))
+        utilities = np.log(bitrates / bitrates[0]) + 1
+        gp = (utilities[-1] - 1) / (BOLA_BUFFER_TARGET / BOLA_MIN_BUFFER - 1)
+        v = BOLA_MIN_BUFFER * self.max_buffer / SEGMENT_TIME / gp
+
+        scores = (v * (utilities + gp) - self.buffer_level / SEGMENT_TIME) / bitrates
+        next_rate = float(bitrates[int(np.argmax(scores))])
+
+        self.bitrates_seg[segment_number] = next_rate
+        self.current_bitrate = next_rate
+        return next_rate
+
+    @algorithm(MPC)
+    def mpc_dash(self, segment_number):
+        throughput = self.throughput()
+        if throughput is None:
+            next_rate = float(min(self.bitrates))
+        else:
+            next_rate = float(self.mpc.decide(self.buffer_level, throughput, self.current_bitrate))
+
+        self.bitrates_seg[segment_number] = next_rate
+        self.current_bitrate = next_rate
+        return next_rate
+
+
+def select_tile_bitrates(weights, costs, bitrates, budget, mandatory):
+    """
+    Greedy multiple choice knapsack over the bitrate ladder: the bitrate index of each tile (-1 = not fetched)
+    maximising the sum of weight * log(1 + bitrate / lowest bitrate) while the costs fit in budget. costs is
+    (tiles, bitrates), mandatory tiles get at least the lowest bitrate whatever the budget.
+    """
+    bitrates = np.asarray(bitrates, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+
+    # Every step of a tile, from not fetched to the lowest bitrate and then up the ladder, by utility per cost
+    utility = np.log1p(bitrates / bitrates[0])
+    gains = weights[:, None] * np.diff(utility, prepend=0)
+    step_costs = np.diff(costs, axis=1, prepend=0)
+    ratios = gains / np.maximum(step_costs, 1e-12)
+    # Non increasing along the ladder, so the steps of a tile are always taken in order
+    ratios = np.minimum.accumulate(ratios, axis=1)
+    ratios[np.asarray(mandatory, dtype=bool), 0] = np.inf
+
+    order = np.argsort(-ratios, axis=None, kind='stable')
+    spent = np.cumsum(step_costs.ravel()[order])
+    taken = order[(spent <= budget) | np.isinf(ratios.ravel()[order])]
+    return np.bincount(taken // len(bitrates), minlength=len(weights)) - 1
@@ -1,9 +1,10 @@
 class VideoPacket:
-    def __init__(self, segment, tile, priority=2, bitrate=1):
+    def __init__(self, segment, tile, priority=2, bitrate=1, size=None):
         self.segment = segment
         self.tile = tile
         self.priority = priority
         self.bitrate = bitrate
+        self.size = size  # Payload size, only carried by the binary protocol
 
     def get_list(self):
         return [self.segment, self.tile, self.priority, self.bitrate]
@@ -12,6 +13,25 @@ class VideoPacket:
         message = self.get_list()
         return str(message).encode()
 
+class VideoBatchPacket:
+    """
+    Request for several tiles of a segment at the same bitrate, in the order they should be sent.
+    """
+    def __init__(self, segment, bitrate, high_priority_tiles, low_priority_tiles):
+        self.segment = segment
+        self.bitrate = bitrate
+        self.high_priority_tiles = high_priority_tiles
+        self.low_priority_tiles = low_priority_tiles
+
+class PlaybackPosition:
+    """
+    Playback position reported by the client: the frame being played and how many frames it plays per second (0 when
+    playback isn't paced in real time).
+    """
+    def __init__(self, frame, fps):
+        self.frame = frame
+        self.fps = fps
+
 class QUICPacket:
     def __init__(self, stream_id, end_stream, video_packet=None):
         self.stream_id = stream_id
@@ -27,9 +47,19 @@ class QUICPacket:
         return str(message).encode()
 
 class VideoRequestMessage:
-    def __init__(self, message_type, segment, tile, bitrate):
+    def __init__(self, message_type, segment, tile, bitrate, priority=2):
         self.message_type = message_type
         self.segment = segment
         self.tile = tile
         self.bitrate = bitrate
+        self.priority = priority
+
+class InitBundleMessage(VideoRequestMessage):
+    """
+    Init segments of several tiles at a bitrate, sent together as a single message of size payload bytes.
+    """
+    def __init__(self, message_type, segment, tiles, bitrate, priority, size):
+        super().__init__(message_type, segment, 0, bitrate, priority)
+        self.tiles = tiles
+        self.size = size
 
@@ -0,0 +1,189 @@
+import math
+import os
+import re
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+
+from src.codec import INIT_ENTRY
+from src.data_types import InitBundleMessage
+from src.video_constants import SERVER_FILE_LOCATION, MAX_TILE, INIT_SEGMENT, INIT_REQUEST, HIGH_PRIORITY
+
+MPD_NAMESPACE = '{urn:mpeg:dash:schema:mpd:2011}'
+MPD_FILE = re.compile(r'dash_tiled_(\d+)\.mpd$')
+TRACK = re.compile(r'_dash_track(\d+)_')
+SEGMENT_FILE = re.compile(r'video_tiled_(\d+)_dash_track(\d+)_(\d+|init)\.(?:m4s|mp4)$')
+ISO_DURATION = re.compile(r'PT(?:(\d+)H)?(?:(\d+)M)?(?:([\d.]+)S)?$')
+
+# Where a file is in the concatenation of all the files of the manifest, in (bitrate, tile, segment) order
+RECORD_DTYPE = np.dtype([('offset', np.int64), ('size', np.int64)])
+
+
+def parse_duration(duration):
+    hours, minutes, seconds = ISO_DURATION.match(duration).groups()
+    return int(hours or 0) * 3600 + int(minutes or 0) * 60 + float(seconds or 0)
+
+
+class ManifestIndex:
+    """
+    Every file of the video, as a (bitrate, segment, tile) array of (offset, size) records: segment 0 is the init
+    segment of the tile, and a size of 0 a file that doesn't exist. Built once from the MPD files (or a scan of the
+    segment files when there are none), then any lookup is an array access.
+    """
+    def __init__(self, files, location=SERVER_FILE_LOCATION):
+        """
+        files maps (segment, tile, bitrate) to a file name in location.
+        """
+        self.location = location
+        self.bitrates = sorted({bitrate for _, _, bitrate in files})
+        n_segments = max((segment for segment, _, _ in files), default=0)
+        n_tiles = max((tile for _, tile, _ in files), default=0) + 1
+
+        # Bitrate -> bitrate index, -1 for bitrates not in the manifest
+        self._level_of = np.full(max(self.bitrates, default=0) + 1, -1)
+        self._level_of[self.bitrates] = np.arange(len(self.bitrates))
+
+        self.records = np.zeros((len(self.bitrates), n_segments + 1, n_tiles), dtype=RECORD_DTYPE)
+        self.file_names = np.empty(self.records.shape, dtype=object)
+        offset = 0
+        for (segment, tile, bitrate) in sorted(files, key=lambda key: (key[2], key[1], key[0])):
+            file_name = os.path.join(location, files[(segment, tile, bitrate)])
+            if not os.path.exists(file_name):
+                continue
+            size = os.path.getsize(file_name)
+            key = (self._level_of[bitrate], segment, tile)
+            self.records[key] = (offset, size)
+            self.file_names[key] = file_name
+            offset += size
+        self.total_size = offset
+
+        self.sizes = self.records['size']
+        self.offsets = self.records['offset']
+
+    @classmethod
+    def load(cls, location=SERVER_FILE_LOCATION):
+        """
+        Manifest of the MPD files in location, or of the segment files found there.
+        """
+        mpd_files = [name for name in sorted(os.listdir(location)) if MPD_FILE.match(name)]
+        if mpd_files:
+            return cls.from_mpd(location, mpd_files)
+        return cls.scan(location)
+
+    @classmethod
+    def from_mpd(cls, location, mpd_files):
+        files = {}
+        for mpd_file in mpd_files:
+            bitrate = int(MPD_FILE.match(mpd_file).group(1))
+            root = ElementTree.parse(os.path.join(location, mpd_file)).getroot()
+            duration = parse_duration(root.get('mediaPresentationDuration'))
+
+            for template in root.iter(MPD_NAMESPACE + 'SegmentTemplate'):
+                tile = int(TRACK.search(template.get('media')).group(1))
+                start = int(template.get('startNumber', 1))
+                n_segments = math.ceil(duration / (int(template.get('duration')) / int(template.get('timescale', 1))))
+
+                files[(INIT_SEGMENT, tile, bitrate)] = template.get('initialization')
+                for segment in range(start, start + n_segments):
+                    files[(segment, tile, bitrate)] = template.get('media').replace('$Number$', str(segment))
+        return cls(files, location)
+
+    @classmethod
+    def scan(cls, location):
+        files = {}
+        for name in os.listdir(location):
+            match = SEGMENT_FILE.match(name)
+            if match:
+                bitrate, tile, segment = match.groups()
+                segment = INIT_SEGMENT if segment == 'init' else int(segment)
+                files[(segment, int(tile), int(bitrate))] = name
+        return cls(files, location)
+
+    @property
+    def n_segments(self):
+        return self.records.shape[1] - 1
+
+    def level(self, bitrate):
+        """
+        Index of a bitrate in the records, -1 when it isn't in the manifest.
+        """
+        bitrate = int(bitrate)
+        return int(self._level_of[bitrate]) if 0 <= bitrate < len(self._level_of) else -1
+
+    def _key(self, segment, tile, bitrate):
+        """
+        Index of a file in the records, None when it isn't in the manifest.
+        """
+        segment, tile, level = int(segment), int(tile), self.level(bitrate)
+        if not (0 <= segment < self.records.shape[1] and 0 < tile < self.records.shape[2]):
+            return None
+        if level < 0 or self.sizes[level, segment, tile] == 0:
+            return None
+        return level, segment, tile
+
+    def exists(self, segment, tile, bitrate):
+        return self._key(segment, tile, bitrate) is not None
+
+    def locate(self, segment, tile, bitrate):
+        """
+        (offset, size) of a file, None when it isn't in the manifest.
+        """
+        key = self._key(segment, tile, bitrate)
+        if key is None:
+            return None
+        return int(self.offsets[key]), int(self.sizes[key])
+
+    def file_name(self, segment, tile, bitrate):
+        key = self._key(segment, tile, bitrate)
+        return None if key is None else self.file_names[key]
+
+    def payload_size(self, message):
+        """
+        Bytes of the payload a request message is answered with: the init segments of an init bundle, otherwise the
+        file of the tile (0 when it isn't in the manifest). What the queues weigh a request by.
+        """
+        if message.message_type == INIT_REQUEST:
+            return message.size
+        location = self.locate(message.segment, message.tile, message.bitrate)
+        return location[1] if location is not None else 0
+
+    def tile_sizes(self, segment, n_tiles=MAX_TILE):
+        """
+        Bytes of every tile of a segment at every bitrate, as a (tile, bitrate) array over tile numbers, None for a
+        segment without files.
+        """
+        if not 0 < segment <= self.n_segments or not self.sizes[:, segment].any():
+            return None
+        sizes = np.zeros((n_tiles, len(self.bitrates)), dtype=np.int64)
+        n_tiles = min(n_tiles, self.sizes.shape[2])
+        sizes[:n_tiles] = self.sizes[:, segment, :n_tiles].T
+        return sizes
+
+
+class InitTracker:
+    """
+    Init segments sent to a session, so each (tile, bitrate) goes once: those needed by a request are bundled into a
+    single message per bitrate, queued with it at high priority, so they don't cost a round trip of their own.
+    """
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self.sent = np.zeros(manifest.sizes.shape[::2], dtype=bool)  # (bitrate, tile)
+
+    def bundles(self, segment, requests):
+        """
+        Init bundle messages for the tiles of the (priority, tile, bitrate) requests of a segment whose init segment
+        wasn't sent yet, which are then marked as sent.
+        """
+        tiles = {}
+        for _, tile, bitrate in requests:
+            level = self.manifest.level(bitrate)
+            if self.manifest.exists(INIT_SEGMENT, tile, bitrate) and not self.sent[level, tile]:
+                self.sent[level, tile] = True
+                tiles.setdefault(int(bitrate), []).append(int(tile))
+
+        bundles = []
+        for bitrate, bitrate_tiles in tiles.items():
+            size = int(self.manifest.sizes[self.manifest.level(bitrate), INIT_SEGMENT, bitrate_tiles].sum())
+            bundles.append(InitBundleMessage(INIT_REQUEST, segment, bitrate_tiles, bitrate, HIGH_PRIORITY,
+                                             size + INIT_ENTRY.size * len(bitrate_tiles)))
+        return bundles
@@ -0,0 +1,118 @@
+import csv
+
+import numpy as np
+
+from src.video_constants import MAX_TILE
+
+# Download samples the throughput estimate is the harmonic mean of
+THROUGHPUT_WINDOW = 5
+# Tile downloads kept for export, the oldest being overwritten
+SAMPLE_CAPACITY = 8192
+
+SAMPLE_FIELDS = ('segment', 'tile', 'bitrate', 'first_byte', 'last_byte', 'bytes')
+SAMPLE_DTYPE = np.dtype([('segment', np.int32), ('tile', np.int32), ('bitrate', np.float64),
+                         ('first_byte', np.float64), ('last_byte', np.float64), ('bytes', np.int64)])
+
+
+class ThroughputEstimator:
+    """
+    Harmonic mean of the throughput of the last downloads, kept in a fixed size ring buffer. The harmonic mean
+    follows the slow samples, so a few fast ones don't make it overshoot.
+    """
+    def __init__(self, window=THROUGHPUT_WINDOW):
+        self.samples = np.zeros(window)
+        self.count = 0
+
+    def add(self, throughput):
+        if throughput > 0:
+            self.samples[self.count % len(self.samples)] = throughput
+            self.count += 1
+
+    def estimate(self):
+        """
+        Throughput in Mbps, None before the first sample.
+        """
+        if self.count == 0:
+            return None
+        samples = self.samples[:min(self.count, len(self.samples))]
+        return len(samples) / float(np.sum(1 / samples))
+
+
+class ThroughputMeter:
+    """
+    First and last byte times and payload bytes of every tile downloaded, aggregated into a goodput sample per
+    segment once all the tiles requested for it arrived, or with what arrived once a later segment is requested:
+    tiles dropped by the server or missing from its manifest never arrive.
+
+    Only the time something was being received counts: the wait for the first byte after a request, and the gaps
+    when the server had nothing to send, are left out. Tiles received at the same time on several streams share
+    that time instead of each counting it. Tiles pushed by the server without being requested are left out of the
+    samples: they were sent at the server's pace, not in answer to the client.
+    """
+    def __init__(self, capacity=SAMPLE_CAPACITY):
+        self.samples = np.zeros(capacity, dtype=SAMPLE_DTYPE)
+        self.count = 0
+        self.request_times = {}
+        self.first_byte_latency = {}
+        self._pending = {}  # segment -> [(tile, bitrate) requested and not received yet, bytes, busy seconds]
+        self._last_byte = 0.0
+
+    def request(self, segment, tiles, bitrate, now):
+        """
+        tiles of segment were requested at time now, at a bitrate or at their entry of an array of per tile bitrates.
+        Returns the goodputs in Mbps of the samples of earlier segments it closed.
+        """
+        goodputs = [self._close(earlier) for earlier in sorted(self._pending) if earlier < segment]
+
+        bitrates = np.broadcast_to(np.asarray(bitrate).astype(int), (MAX_TILE,))
+        self.request_times.setdefault(segment, now)
+        pending = self._pending.setdefault(segment, [set(), 0, 0.0])
+        pending[0].update((int(tile), int(bitrates[tile])) for tile in tiles)
+        return [goodput for goodput in goodputs if goodput is not None]
+
+    def record(self, segment, tile, bitrate, first_byte, last_byte, size):
+        """
+        A tile of size payload bytes was received between first_byte and last_byte. Returns the goodput of the
+        segment in Mbps when it was its last requested tile, otherwise None.
+        """
+        self.samples[self.count % len(self.samples)] = (segment, tile, bitrate, first_byte, last_byte, size)
+        self.count += 1
+
+        busy = max(last_byte - max(first_byte, self._last_byte), 0.0)
+        self._last_byte = max(self._last_byte, last_byte)
+
+        pending = self._pending.get(segment)
+        if pending is None or (int(tile), int(bitrate)) not in pending[0]:
+            return None
+        if segment not in self.first_byte_latency:
+            self.first_byte_latency[segment] = first_byte - self.request_times[segment]
+        pending[0].discard((int(tile), int(bitrate)))
+        pending[1] += size
+        pending[2] += busy
+        if pending[0]:
+            return None
+
+        return self._close(segment)
+
+    def _close(self, segment):
+        """
+        Ends the sample of segment, tiles requested later on start a new one. Returns its goodput in Mbps, None when
+        nothing was received.
+        """
+        _, size, busy = self._pending.pop(segment)
+        return size * 8 / 1000000 / busy if busy > 0 else None
+
+    def raw_samples(self):
+        """
+        The tile downloads kept, oldest first.
+        """
+        if self.count <= len(self.samples):
+            return self.samples[:self.count].copy()
+        start = self.count % len(self.samples)
+        return np.concatenate((self.samples[start:], self.samples[:start]))
+
+    def export(self, file_name):
+        with open(file_name, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(SAMPLE_FIELDS)
+            writer.writerows(sample.tolist() for sample in self.raw_samples())
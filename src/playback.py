@@ -0,0 +1,70 @@
+import asyncio
+
+
+class PlaybackClock:
+    """
+    Paces playback frames on the event loop. Frame n is due at start + n * frame_time / speed on the loop's monotonic
+    clock, so deadlines are absolute and the time spent handling a frame (or a late wake up) doesn't accumulate as
+    drift. A speed above 1 plays the trace faster than real time.
+    """
+    def __init__(self, frame_time, speed=1.0):
+        self.frame_time = frame_time / speed
+        self.fps = 1 / self.frame_time
+        self.start_time = None
+        self.late_frames = 0
+        self.max_lateness = 0.0
+        self._loop = None
+
+    def start(self):
+        self._loop = asyncio.get_event_loop()
+        self.start_time = self._loop.time()
+
+    def deadline(self, frame):
+        return self.start_time + frame * self.frame_time
+
+    def now(self):
+        """
+        Playback position in frames.
+        """
+        return (self._loop.time() - self.start_time) / self.frame_time
+
+    async def wait_frame(self, frame):
+        deadline = self.deadline(frame)
+        lateness = self._loop.time() - deadline
+
+        if lateness > 0:
+            if lateness > self.frame_time:
+                self.late_frames += 1
+            self.max_lateness = max(self.max_lateness, lateness)
+            # Still give the other coroutines a chance to run
+            await asyncio.sleep(0)
+            return
+
+        waiter = self._loop.create_future()
+        handle = self._loop.call_at(deadline, waiter.set_result, None)
+        try:
+            await waiter
+        finally:
+            handle.cancel()
+
+
+class VirtualClock(PlaybackClock):
+    """
+    Playback clock that doesn't wait at all: every frame is due as soon as the previous one was handled, which runs
+    a whole user input trace as fast as possible for offline evaluation.
+    """
+    def __init__(self, frame_time):
+        super().__init__(frame_time)
+        self.fps = 0
+        self.frame = 0
+
+    def start(self):
+        self.start_time = 0.0
+        self.frame = 0
+
+    def now(self):
+        return self.frame
+
+    async def wait_frame(self, frame):
+        self.frame = frame
+        await asyncio.sleep(0)
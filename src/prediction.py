@@ -0,0 +1,217 @@
+import math
+from collections import deque
+
+import numpy as np
+
+from src.video_constants import GRID_ROWS, GRID_COLS, N_SEGMENTS
+
+REPLAY_PREDICTOR = 'replay'
+LAST_PREDICTOR = 'last'
+LINEAR_PREDICTOR = 'linear'
+HEATMAP_PREDICTOR = 'heatmap'
+HYBRID_PREDICTOR = 'hybrid'
+
+# Head positions the linear predictor fits a line through
+HISTORY = 4
+# Probability given to the tiles next to a predicted viewport
+MARGIN_PROBABILITY = 0.5
+# Viewers the heatmap needs before the hybrid predictor trusts it as much as the head motion
+HEATMAP_PRIOR_VIEWS = 4
+
+
+def tiles_to_grid(tiles):
+    """
+    Boolean GRID_ROWS x GRID_COLS grid with the given tiles set. Tiles are numbered from 1 in row order.
+    """
+    grid = np.zeros(GRID_ROWS * GRID_COLS, dtype=bool)
+    grid[np.asarray(tiles, dtype=int) - 1] = True
+    return grid.reshape(GRID_ROWS, GRID_COLS)
+
+def grid_to_tiles(grid):
+    return np.flatnonzero(np.asarray(grid).ravel()) + 1
+
+def viewport_center(grid):
+    """
+    (row, column) at the center of the tiles set in grid. Columns are yaw and wrap around, so their mean is taken on
+    the circle.
+    """
+    rows, cols = np.nonzero(grid)
+    if rows.size == 0:
+        return None
+    angles = cols * (2 * math.pi / GRID_COLS)
+    col = math.atan2(np.sin(angles).mean(), np.cos(angles).mean()) * GRID_COLS / (2 * math.pi)
+    return float(rows.mean()), col % GRID_COLS
+
+def shift_grid(grid, rows, cols):
+    """
+    Moves a grid by whole tiles: around the sphere horizontally, clipped at the poles vertically.
+    """
+    rows = int(round(rows))
+    shifted = np.roll(grid, (rows, int(round(cols))), axis=(0, 1))
+    if rows > 0:
+        shifted[:rows] = 0
+    elif rows < 0:
+        shifted[rows:] = 0
+    return shifted
+
+def dilate(grid):
+    """
+    The tiles of grid and their 8 neighbours (wrapping around horizontally).
+    """
+    grid = np.asarray(grid, dtype=bool)
+    dilated = grid.copy()
+    for rows in (-1, 0, 1):
+        for cols in (-1, 0, 1):
+            dilated |= shift_grid(grid, rows, cols)
+    return dilated
+
+
+class LastViewportPredictor:
+    """
+    The viewport doesn't move: the last FOV seen, with a margin around it.
+    """
+    def __init__(self):
+        self.last = None
+
+    def observe(self, segment, tiles):
+        """
+        The FOV of the viewer at the start of segment. It may be given again for the same segment as more of its
+        tiles are requested, replacing the previous one.
+        """
+        if len(tiles):
+            self.last = tiles_to_grid(tiles)
+
+    def predict(self, segment):
+        """
+        Probability of each tile of the grid being in the FOV during segment.
+        """
+        if self.last is None:
+            return np.zeros((GRID_ROWS, GRID_COLS))
+        return with_margin(self.last)
+
+
+class LinearPredictor:
+    """
+    Dead reckoning of the head: a least squares line through the last viewport centers, extrapolated to the segment,
+    moves the last FOV seen. Samples are keyed by segment here, but any increasing time (frames...) works.
+    """
+    def __init__(self, history=HISTORY):
+        self.samples = deque(maxlen=history)  # (segment, row, unwrapped column)
+        self.last = None
+
+    def observe(self, segment, tiles):
+        if not len(tiles):
+            return
+        grid = tiles_to_grid(tiles)
+        row, col = viewport_center(grid)
+        if self.samples and self.samples[-1][0] == segment:
+            self.samples.pop()
+        if self.samples:
+            # Keep columns continuous across the wrap around, so a head turning keeps a straight line
+            previous = self.samples[-1][2]
+            col = previous + (col - previous + GRID_COLS / 2) % GRID_COLS - GRID_COLS / 2
+        self.samples.append((segment, row, col))
+        self.last = grid
+
+    def motion(self):
+        """
+        Velocity of the head as (rows, columns) per unit of time of the samples, and the root mean square distance of
+        the samples to the line, in tiles. No motion before there are two samples.
+        """
+        if len(self.samples) < 2:
+            return np.zeros(2), 0.0
+        samples = np.array(self.samples, dtype=float)
+        times = samples[:, 0] - samples[-1, 0]
+        slopes, intercepts = np.polyfit(times, samples[:, 1:], 1)
+        residuals = np.outer(times, slopes) + intercepts - samples[:, 1:]
+        return slopes, float(np.sqrt(np.mean(np.sum(residuals ** 2, axis=1))))
+
+    def predict(self, segment):
+        if self.last is None:
+            return np.zeros((GRID_ROWS, GRID_COLS))
+        velocity, _ = self.motion()
+        ahead = segment - self.samples[-1][0]
+        return with_margin(shift_grid(self.last, velocity[0] * ahead, velocity[1] * ahead))
+
+
+class PopularityHeatmap:
+    """
+    How often each tile was in the FOV of the viewers of a segment, aggregated over all the sessions of the video.
+    """
+    def __init__(self, n_segments=N_SEGMENTS):
+        self.counts = np.zeros((n_segments + 2, GRID_ROWS, GRID_COLS))
+        self.views = np.zeros(n_segments + 2)
+
+    def add(self, segment, grid, views=1):
+        """
+        Adds the FOV grid of views viewers to the segment, a negative count removing them.
+        """
+        if 0 < segment < len(self.views):
+            self.counts[segment] += views * grid
+            self.views[segment] += views
+
+    def probability(self, segment):
+        if not 0 < segment < len(self.views) or self.views[segment] == 0:
+            return np.zeros((GRID_ROWS, GRID_COLS))
+        return self.counts[segment] / self.views[segment]
+
+
+class HeatmapPredictor:
+    """
+    The tiles other viewers of the video looked at during the segment.
+    """
+    def __init__(self, heatmap):
+        self.heatmap = heatmap
+        self._added = None  # (segment, grid) this session added to the heatmap last
+
+    def observe(self, segment, tiles):
+        if not len(tiles):
+            return
+        if self._added is not None and self._added[0] == segment:
+            self.heatmap.add(segment, self._added[1], -1)
+        self._added = (segment, tiles_to_grid(tiles))
+        self.heatmap.add(segment, self._added[1])
+
+    def predict(self, segment):
+        return self.heatmap.probability(segment)
+
+
+class HybridPredictor:
+    """
+    Head motion and popularity together: the heatmap gets more weight as more viewers went through the segment.
+    """
+    def __init__(self, heatmap, history=HISTORY):
+        self.linear = LinearPredictor(history)
+        self.popularity = HeatmapPredictor(heatmap)
+        self.heatmap = heatmap
+
+    def observe(self, segment, tiles):
+        self.linear.observe(segment, tiles)
+        self.popularity.observe(segment, tiles)
+
+    def predict(self, segment):
+        views = self.heatmap.views[segment] if 0 < segment < len(self.heatmap.views) else 0
+        weight = views / (views + HEATMAP_PRIOR_VIEWS)
+        return (1 - weight) * self.linear.predict(segment) + weight * self.heatmap.probability(segment)
+
+
+def with_margin(grid):
+    return np.maximum(np.asarray(grid, dtype=float), MARGIN_PROBABILITY * dilate(grid))
+
+def create_predictor(name, heatmap=None):
+    """
+    Viewport predictor of a session, None for the replay push (the tiles of the last request, as requested).
+    heatmap is shared by the sessions of the video.
+    """
+    if name == REPLAY_PREDICTOR:
+        return None
+    elif name == LAST_PREDICTOR:
+        return LastViewportPredictor()
+    elif name == LINEAR_PREDICTOR:
+        return LinearPredictor()
+    elif name == HEATMAP_PREDICTOR:
+        return HeatmapPredictor(heatmap)
+    elif name == HYBRID_PREDICTOR:
+        return HybridPredictor(heatmap)
+    else:
+        raise ValueError('Unknown viewport predictor: ' + str(name))
@@ -0,0 +1,100 @@
+import math
+
+import numpy as np
+
+from src.prediction import LinearPredictor, shift_grid
+from src.viewport import dilate_mask, grid_to_mask, mask_to_grid
+from src.video_constants import GRID_ROWS, GRID_COLS, MAX_TILE, N_SEGMENTS, VIDEO_FPS, SEGMENT_TIME
+
+# Segments requested ahead of the one being played
+HORIZON = 0
+# Frames of head motion the prediction is fitted on
+WINDOW = 15
+# Frames between two prefetch rounds
+PREFETCH_INTERVAL = 10
+# Share of the predicted head movement added to the fit error as uncertainty, and the widest margin in tiles
+MOTION_UNCERTAINTY = 0.25
+MAX_MARGIN = 3
+
+
+class PrefetchEngine:
+    """
+    Predicts the viewport of the next segments from the last frames of user input, by dead reckoning: the linear
+    predictor, fed with frames instead of segments, gives the head velocity, and the current FOV is moved along it
+    over the frames of each segment ahead. The prediction is widened by a margin that grows with the fit error and the
+    distance predicted, so uncertain predictions cover more tiles.
+
+    It also keeps what was predicted and what was actually viewed for every segment, to report the accuracy.
+    """
+    def __init__(self, horizon=HORIZON, window=WINDOW, n_segments=N_SEGMENTS):
+        self.horizon = horizon
+        self.n_segments = n_segments
+        self.head = LinearPredictor(window)
+        self.frame = 0  # Last frame observed
+        self.predicted = np.zeros((n_segments + 1, GRID_ROWS, GRID_COLS), dtype=bool)
+        self.viewed = np.zeros((n_segments + 1, GRID_ROWS, GRID_COLS), dtype=bool)
+
+    def observe(self, frame, tiles):
+        """
+        FOV tiles of a frame being played.
+        """
+        if not len(tiles):
+            return
+        self.head.observe(frame, tiles)
+        self.frame = frame
+
+        segment = segment_of(frame)
+        if segment <= self.n_segments:
+            self.viewed[segment] |= self.head.last
+
+    def segments_ahead(self, segment):
+        return range(segment + 1, min(segment + self.horizon, self.n_segments) + 1)
+
+    def predict(self, frame, segment):
+        """
+        Tiles predicted to be in the FOV at some point of segment, seen from frame.
+        """
+        fov = self.head.last
+        if fov is None:
+            return np.array([], dtype=int)
+
+        first, last = segment_frames(segment)
+        velocity, error = self.head.motion()
+
+        # The head moves along the line during the whole segment
+        mask = np.zeros(MAX_TILE, dtype=bool)
+        for target in (first, (first + last) / 2, last):
+            movement = velocity * (target - frame)
+            mask |= grid_to_mask(shift_grid(fov, movement[0], movement[1]))
+
+        distance = float(np.hypot(*(velocity * (last - frame))))
+        mask = dilate_mask(mask, min(int(math.ceil(error + MOTION_UNCERTAINTY * distance)), MAX_MARGIN))
+
+        self.predicted[segment] |= mask_to_grid(mask)
+        return np.flatnonzero(mask)
+
+    def accuracy(self):
+        """
+        For every segment something was predicted for: (share of the viewed tiles that were predicted, share of the
+        predicted tiles that were viewed).
+        """
+        accuracy = {}
+        for segment in range(1, self.n_segments + 1):
+            predicted = self.predicted[segment]
+            if not predicted.any():
+                continue
+            hits = np.count_nonzero(predicted & self.viewed[segment])
+            accuracy[segment] = (hits / max(np.count_nonzero(self.viewed[segment]), 1),
+                                 hits / np.count_nonzero(predicted))
+        return accuracy
+
+
+def segment_of(frame):
+    return (int(frame) - 1) // (SEGMENT_TIME * VIDEO_FPS) + 1
+
+def segment_frames(segment):
+    """
+    First and last frames played during segment.
+    """
+    frames = SEGMENT_TIME * VIDEO_FPS
+    return (segment - 1) * frames + 1, segment * frames
@@ -0,0 +1,77 @@
+import numpy as np
+
+from src.video_constants import N_SEGMENTS, HIGH_PRIORITY, LOW_PRIORITY, BITRATES
+
+PUSH_DEPTH = 1
+# Predicted probability from which a tile is pushed as FOV (high priority, requested bitrate), and from which it is
+# pushed at all (low priority, lowest bitrate)
+FOV_PROBABILITY = 0.5
+PUSH_PROBABILITY = 0.1
+
+
+class PushPlanner:
+    """
+    Chooses the tiles the server pushes before the client asks for them, as long as they fit in the byte budget.
+    Planning happens when a request arrives, and when the client reports playing a new segment: a segment whose tiles
+    were all pushed gets no request, and the pushes must still go on to the segments after it. An idle session costs
+    nothing.
+
+    Without a predictor the requests of the last segment requested are taken as the client's latest view: the same
+    tiles, in the same order (FOV first), are pushed for the next depth segments at the same bitrate. With a viewport
+    predictor the FOV of each request is fed to it, and the tiles pushed are the likely ones, most likely first, the
+    less likely ones at the lowest bitrate.
+    """
+    def __init__(self, depth=PUSH_DEPTH, predictor=None, n_segments=N_SEGMENTS):
+        self.depth = depth
+        self.predictor = predictor
+        self.n_segments = n_segments
+        self.pushed = set()
+        self._requests = (None, [])  # (priority, tile, bitrate) requested so far for the last segment requested
+
+    def was_pushed(self, segment, tile, bitrate):
+        return (int(segment), int(tile), int(bitrate)) in self.pushed
+
+    def plan(self, segment, requests, budget_bytes, tile_bytes):
+        """
+        Returns the (segment, priority, tile, bitrate) to push after a request for the (priority, tile, bitrate) of
+        segment, or while segment is played when there are no requests, spending at most budget_bytes with tiles of
+        tile_bytes on average.
+        """
+        if requests:
+            # Requests of a single tile add up to the view of their segment
+            if self._requests[0] != segment:
+                self._requests = (segment, [])
+            self._requests[1].extend(requests)
+            fov = [tile for priority, tile, _ in self._requests[1] if priority == HIGH_PRIORITY]
+            if self.predictor is not None and fov:
+                self.predictor.observe(int(segment), fov)
+        requests = self._requests[1]
+
+        pushes = []
+        for push_segment in range(int(segment) + 1, min(int(segment) + self.depth, self.n_segments) + 1):
+            if self.predictor is None:
+                candidates = requests
+            else:
+                candidates = self.predicted_tiles(push_segment, requests[0][2] if requests else BITRATES[0])
+
+            for priority, tile, bitrate in candidates:
+                key = (push_segment, int(tile), int(bitrate))
+                if key in self.pushed:
+                    continue
+                if budget_bytes < tile_bytes:
+                    return pushes
+
+                budget_bytes -= tile_bytes
+                self.pushed.add(key)
+                pushes.append((push_segment, priority, tile, bitrate))
+        return pushes
+
+    def predicted_tiles(self, segment, bitrate):
+        """
+        (priority, tile, bitrate) of the tiles likely to be in the FOV during segment, most likely first.
+        """
+        probability = self.predictor.predict(segment).ravel()
+        order = np.argsort(-probability, kind='stable')
+        order = order[probability[order] >= PUSH_PROBABILITY]
+        return [(HIGH_PRIORITY, int(index) + 1, bitrate) if probability[index] >= FOV_PROBABILITY
+                else (LOW_PRIORITY, int(index) + 1, BITRATES[0]) for index in order]
@@ -1,107 +1,208 @@
 from asyncio import Queue
+from collections import deque
 import heapq
+import itertools
+import math
+import time
+
+from src.video_constants import WFQ_WEIGHTS, DROP_EXPIRED, VIDEO_FPS, SEGMENT_TIME, WFQ_QUEUE, SP_QUEUE, EDF_QUEUE, \
+    CLOSE_REQUEST, INIT_REQUEST, INIT_SEGMENT
 
 class StrictPriorityQueue(Queue):
     def _init(self, maxsize):
         self._queue = []
+        self._order = itertools.count()  # Keeps FIFO order between items with the same priority
 
     def _put(self, item, heappush=heapq.heappush):
-        heappush(self._queue, item)
+        heappush(self._queue, (item[0], next(self._order), item[1]))
 
     def _get(self, heappop=heapq.heappop):
-        return heappop(self._queue)[1]
+        return heappop(self._queue)[2]
 
 class WeightedFairQueue(Queue):
 
     # Source: http://www.csun.edu/ansr/resources/simul15_paper.pdf
     #
     # In GPS (Generalized Processor Sharing), for any t seconds on a link capable of sending b bits per second, each
-    # nonempty queue sends b ∗ t ∗ w bits, with 'w' being the share of the bandwidth that the link has.
+    # nonempty queue sends b * t * w bits, with 'w' being the share of the bandwidth that the link has.
     # To simulate GPS, the WFQ method calculates the order in which the last bit of each packet would be sent by a GPS
-    # scheduler and dequeues the packets in that order
+    # scheduler and dequeues the packets in that order.
+    #
+    # This is WF2Q+ (Bennett and Zhang, "Hierarchical packet fair queueing algorithms"): only the packets at the head
+    # of each class are tagged, with a virtual start and finish time, and the next packet is the one with the
+    # smallest finish time among those that already started in the GPS reference (start time <= virtual time). The
+    # virtual time advances by the length of each packet sent and jumps to the smallest start time when no packet is
+    # eligible. Each class keeps two tags and at most one entry in one of the two heaps, so an operation costs
+    # O(log n) for n classes and the state doesn't grow with the session.
+
+    def __init__(self, maxsize=0, weights=WFQ_WEIGHTS):
+        if not weights or any(weight <= 0 for weight in weights):
+            raise ValueError('WFQ weights must all be positive: ' + str(list(weights)))
+        total = float(sum(weights))
+        self.weights = [weight / total for weight in weights]  # Share of the bandwidth for each class
+        super().__init__(maxsize)
 
     def _init(self, maxsize):
-        self.n = 2  # Number of different priorities (for now we have in FOV, and out of FOV)
-        self._queue = []
-        self.active = [False, False]
-        self.weight = [0.75, 0.25]  # Share of the bandwidth for each queue
-        self.ST = [[],[]] # Start time queues
-        self.FT = [[], []] # Finish time queues
-        self.VT = 0 # Virtual time
-        self.time = 0
-        self.last_time = 0
-        self.last_VT = 0
-
-    def _put (self, item, heappush=heapq.heappush):
-        priority = item[0]-1
+        self.n = len(self.weights)  # Number of priority classes, priority p goes to class p - 1
+        self.classes = [deque() for _ in range(self.n)]  # (length, content) of the packets waiting in each class
+        self.start = [0.0] * self.n  # Virtual start time of the head packet of each class
+        self.finish = [0.0] * self.n  # Virtual finish time of the head packet (or of the last one sent)
+        self.eligible = []  # (finish time, order, class) of the head packets with start time <= virtual time
+        self.waiting = []  # (start time, order, class) of the other head packets
+        self.VT = 0.0  # Virtual time
+        self.size = 0
+        self._order = itertools.count()
+
+    def _qsize(self):
+        return self.size
+
+    def qsize(self):
+        return self.size
+
+    def empty(self):
+        return self.size == 0
+
+    def _put(self, item):
+        priority = min(max(int(item[0]), 1), self.n) - 1
         length = item[1]
         content = item[2]
 
-        self.update_virtual_time(length)
+        self.classes[priority].append((length, content))
+        self.size += 1
+        if len(self.classes[priority]) == 1:
+            self.start[priority] = max(self.finish[priority], self.VT)
+            self._tag_head(priority)
+
+    def _get(self):
+        if not self.eligible:
+            # Nothing started in the GPS reference yet: jump to the next start time
+            self.VT = max(self.VT, self.waiting[0][0])
+        self._update_eligible()
+
+        _, _, priority = heapq.heappop(self.eligible)
+        length, content = self.classes[priority].popleft()
+        self.size -= 1
+        self.VT += length
+
+        if self.classes[priority]:
+            self.start[priority] = self.finish[priority]
+            self._tag_head(priority)
+        return content
+
+    def _tag_head(self, priority):
+        length = self.classes[priority][0][0]
+        self.finish[priority] = self.start[priority] + length / self.weights[priority]
+        if self.start[priority] <= self.VT:
+            heapq.heappush(self.eligible, (self.finish[priority], next(self._order), priority))
+        else:
+            heapq.heappush(self.waiting, (self.start[priority], next(self._order), priority))
 
-        self.activate(priority)
+    def _update_eligible(self):
+        while self.waiting and self.waiting[0][0] <= self.VT:
+            _, order, priority = heapq.heappop(self.waiting)
+            heapq.heappush(self.eligible, (self.finish[priority], order, priority))
 
-        if len(self.FT[priority]) == 0:
-            ST = 0
-        else:
-            ST = max(self.FT[priority][-1], self.VT)
 
-        finish_time = ST + length/self.weight[priority]
-        self.FT[priority].append(finish_time)
-        new_item = (finish_time, content)
+def segment_deadline(segment):
+    """
+    Playout deadline of the tiles of a segment, in frames: the last frame of the segment, after which they can't be
+    shown anymore.
+    """
+    return int(segment) * SEGMENT_TIME * VIDEO_FPS
 
-        heappush(self._queue, new_item)
 
-    def _get(self, heappop=heapq.heappop):
-        return heappop(self._queue)[1]
-
-    def get_active_min_F(self):
-        try:
-            first_active = self.active.index(True)
-        except ValueError:
-            return -1
-
-        minimum = self.FT[first_active][-1]
-        index = first_active
-        for i in range(first_active + 1, self.n):
-            if self.active[i] and self.FT[i][-1] < minimum:
-                minimum = self.FT[i][-1]
-                index = i
-
-        return index
-
-    def get_active_sum(self):
-        total_weight = 0
-        for i in range(self.n):
-            if self.active[i]:
-                total_weight += self.weight[i]
-
-        return total_weight
-
-    def update_virtual_time(self, packet_len):
-        total_weight = self.get_active_sum()
-        updated = False
-
-        while not updated and total_weight > 0:
-            min_f = self.get_active_min_F()
-            if min_f == -1:
-                exit()
-            idle_time = self.time - self.last_time
-            tmp = self.last_VT + idle_time*packet_len/total_weight
-
-            if self.FT[min_f][-1] <= tmp:
-                self.deactivate(min_f)
-                self.last_time = self.last_time + (self.FT[min_f][-1] - self.last_VT) * total_weight / packet_len
-                self.last_VT = self.FT[min_f][-1]
-                total_weight = self.get_active_sum()
-            else:
-                self.VT = tmp
-                self.last_time = self.VT
-                self.last_VT = self.time
-                updated = True
+class EarliestDeadlineQueue(Queue):
+    """
+    Earliest deadline first: items are (deadline in frames, priority, content), served by deadline, then priority.
+    Items with an infinite deadline (the close request) go after everything else, and init segments (bundled or one
+    by one), whose deadline is minus infinity, before everything else and never expire.
 
-    def deactivate(self, index):
-        self.active[index] = False
+    The client reports its playback position, which is extrapolated at the rate it plays frames. Items whose deadline
+    was already played are dropped, or with the demote policy only sent once nothing on time is left.
+    """
+    def __init__(self, maxsize=0, expired=DROP_EXPIRED, clock=time.monotonic):
+        self.expired = expired
+        self.clock = clock
+        super().__init__(maxsize)
 
-    def activate(self, index):
-        self.active[index] = True
+    def _init(self, maxsize):
+        self._queue = []  # (deadline, priority, order, content)
+        self._late = []  # Demoted items, same layout
+        self._order = itertools.count()  # Keeps FIFO order between items with the same deadline and priority
+        self.position = None  # (frame, frames per second, report time)
+        self.dropped = 0
+        self.demoted = 0
+
+    def report_position(self, frame, fps):
+        self.position = (frame, fps, self.clock())
+
+    def playback_frame(self):
+        if self.position is None:
+            return -math.inf
+        frame, fps, report_time = self.position
+        return frame + (self.clock() - report_time) * fps
+
+    def _qsize(self):
+        return len(self._queue) + len(self._late)
+
+    def qsize(self):
+        return self._qsize()
+
+    def empty(self):
+        self._expire()
+        return not self._queue and not self._late
+
+    def _put(self, item):
+        heapq.heappush(self._queue, (item[0], item[1], next(self._order), item[2]))
+
+    def _get(self):
+        self._expire()
+        if self._queue:
+            return heapq.heappop(self._queue)[3]
+        return heapq.heappop(self._late)[3]
+
+    def _expire(self):
+        frame = self.playback_frame()
+        while self._queue and -math.inf < self._queue[0][0] < frame:
+            item = heapq.heappop(self._queue)
+            if self.expired == DROP_EXPIRED:
+                self.dropped += 1
+            else:
+                heapq.heappush(self._late, item)
+                self.demoted += 1
+
+    def stats(self):
+        return {'dropped': self.dropped, 'demoted': self.demoted}
+
+
+def create_queue(queue_type, weights=WFQ_WEIGHTS, expired=DROP_EXPIRED, clock=time.monotonic):
+    """
+    Request queue of a session, FIFO unless queue_type is one of the others.
+    """
+    if queue_type == WFQ_QUEUE:
+        return WeightedFairQueue(weights=weights)
+    elif queue_type == SP_QUEUE:
+        return StrictPriorityQueue()
+    elif queue_type == EDF_QUEUE:
+        return EarliestDeadlineQueue(expired=expired, clock=clock)
+    else:
+        return Queue()
+
+def queue_item(queue_type, message, size):
+    """
+    What a request message is put in a queue of queue_type as: with the priority, size or deadline it is ordered by.
+    """
+    if queue_type == WFQ_QUEUE:
+        return message.priority, size, message
+    elif queue_type == SP_QUEUE:
+        return message.priority, message
+    elif queue_type == EDF_QUEUE:
+        if message.message_type == CLOSE_REQUEST:
+            deadline = math.inf
+        elif message.message_type == INIT_REQUEST or message.segment == INIT_SEGMENT:
+            deadline = -math.inf
+        else:
+            deadline = segment_deadline(message.segment)
+        return deadline, message.priority, message
+    else:
+        return message
@@ -0,0 +1,68 @@
+import numpy as np
+
+from src.video_constants import N_SEGMENTS, MAX_TILE
+
+
+class PlaybackReport:
+    """
+    Tiles missing from every frame played, overall and in the FOV, by segment, and the report printed at the end of
+    a session from them and from the state of the adaptation, buffer and measurements.
+    """
+    def __init__(self, n_segments=N_SEGMENTS):
+        self.n_segments = n_segments
+        # Indexed by segment, the frames played after the last segment go to the one after it
+        self.missed = np.zeros(n_segments + 2, dtype=np.int64)
+        self.total = np.zeros(n_segments + 2, dtype=np.int64)
+        self.missed_fov = np.zeros(n_segments + 2, dtype=np.int64)
+        self.total_fov = np.zeros(n_segments + 2, dtype=np.int64)
+
+    def add_frame(self, segment, missing, fov_mask):
+        """
+        A frame of segment was played with the tiles of the missing mask missing and those of fov_mask in the FOV.
+        """
+        segment = min(int(segment), self.n_segments + 1)
+        self.missed[segment] += np.count_nonzero(missing)
+        self.total[segment] += MAX_TILE - 1
+        self.missed_fov[segment] += np.count_nonzero(missing & fov_mask)
+        self.total_fov[segment] += np.count_nonzero(fov_mask)
+
+    def missing_ratio(self):
+        """
+        Missing ratio of all the tiles and of the FOV ones, in percent.
+        """
+        return (round(int(self.missed.sum()) / max(int(self.total.sum()), 1) * 100, 2),
+                round(int(self.missed_fov.sum()) / max(int(self.total_fov.sum()), 1) * 100, 2))
+
+    def print(self, dash, buffer, meter, clock=None, prefetch=None):
+        missing_ratio = {}
+        missing_ratio_fov = {}
+        download_time_seg = {}
+        sum_bitrate = 0
+        for i in range(1, self.n_segments + 1):
+            missing_ratio[i] = str(round(int(self.missed[i]) / max(int(self.total[i]), 1) * 100, 2))+"%"
+            missing_ratio_fov[i] = str(round(int(self.missed_fov[i]) / max(int(self.total_fov[i]), 1) * 100, 2))+'%'
+
+            sum_bitrate += dash.bitrates_seg.get(i, 0)
+            if i in dash.previous_segment_times_seg:
+                download_time_seg[i] = str(round(dash.previous_segment_times_seg[i], 2))+'s'
+            else:
+                download_time_seg[i] = 'NOT_FINISHED'
+
+        missing_ratio_total, missing_ratio_total_fov = self.missing_ratio()
+
+        print("Missing ratio total: "+str(missing_ratio_total)+"%")
+        print("Missing ratio total (campo visão): "+str(missing_ratio_total_fov)+"%")
+        print("Missing ratio por segmento: "+str(missing_ratio))
+        print("Missing ratio por segmento (campo visão): "+str(missing_ratio_fov))
+        print("Tempo total de download: "+str(round(dash.total_download_time, 2))+"s")
+        print("Tempo total de download por segmento: "+str(download_time_seg))
+        print("Bitrate médio: "+str(round(sum_bitrate / self.n_segments, 2)))
+        print("Bitrate por segmento: "+str(dash.bitrates_seg))
+        latencies = {segment: str(round(latency*1000, 1))+'ms' for segment, latency in sorted(meter.first_byte_latency.items())}
+        print("Latência até o primeiro byte por segmento: "+str(latencies))
+        print("Travamentos: "+str(buffer.stall_count())+" (tempo de rebuffering: "+str(round(buffer.rebuffering_time(), 2))+"s)")
+        if prefetch is not None and prefetch.horizon > 0:
+            accuracy = {segment: str(round(recall*100, 1))+'%/'+str(round(precision*100, 1))+'%' for segment, (recall, precision) in prefetch.accuracy().items()}
+            print("Predição do campo de visão por segmento (acerto/precisão): "+str(accuracy))
+        if clock is not None:
+            print("Frames atrasados: "+str(clock.late_frames)+" (atraso máximo: "+str(round(clock.max_lateness*1000, 1))+"ms)")
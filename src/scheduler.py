@@ -0,0 +1,163 @@
+import asyncio
+import math
+import time
+from collections import deque
+
+from src.video_constants import CLOSE_REQUEST
+
+# Bytes a session may send per round before the next one gets its turn
+QUANTUM = 16 * 1024
+# Credit the egress budget can build up while idle, in seconds of traffic
+BURST_TIME = 0.01
+
+
+def jain_index(values):
+    """
+    Jain's fairness index: 1 when all the values are equal, 1/n when a single one gets everything.
+    """
+    values = list(values)
+    total = sum(values)
+    squares = sum(value * value for value in values)
+    if not values or squares == 0:
+        return 1.0
+    return total * total / (len(values) * squares)
+
+
+class Session:
+    """
+    A client connection as seen by the scheduler: its own request queue, which orders its tiles (by priority,
+    deadline...), and the coroutine sending a request, which returns the bytes written.
+    """
+    def __init__(self, name, queue, send):
+        self.name = name
+        self.queue = queue
+        self.send = send
+        self.deficit = 0
+        self.active = False
+        self.closed = asyncio.get_event_loop().create_future()
+        self.bytes = 0
+        self.tiles = 0
+        self.bytes_by_priority = {}
+        self.start_time = time.monotonic()
+
+    def throughput(self):
+        """
+        Bytes sent per second since the session started.
+        """
+        return self.bytes / max(time.monotonic() - self.start_time, 1e-6)
+
+    def stats(self):
+        return {
+            'tiles': self.tiles,
+            'bytes': self.bytes,
+            'bytes_by_priority': dict(sorted(self.bytes_by_priority.items())),
+            'throughput': round(self.throughput()),
+        }
+
+
+class GlobalScheduler:
+    """
+    Server wide scheduler above the queues of the sessions: deficit round robin between the sessions with requests
+    waiting, each session's own queue choosing which of its tiles goes next. A session's deficit may go negative when
+    a tile is larger than what it had left, it then waits for enough rounds to pay it back, so sessions get the same
+    bytes whatever the size of their tiles.
+
+    All the sends go through a token bucket refilled at the egress rate (0 = unlimited). aioquic writers never block,
+    so without a budget every tile goes straight to the QUIC send buffers and the scheduler only decides the order
+    they are written in: the bandwidth is then shared by QUIC congestion control, not by the rounds, and the sessions
+    only get fair shares with an egress rate at or below the real capacity of the link.
+    """
+    def __init__(self, quantum=QUANTUM, rate=0):
+        self.quantum = quantum
+        self.rate = rate
+        self.burst = max(quantum, rate * BURST_TIME)
+        self.sessions = []
+        self._active = deque()
+        self._wakeup = asyncio.Event()
+        self._tokens = self.burst
+        self._last_refill = time.monotonic()
+
+    def add_session(self, name, queue, send):
+        session = Session(name, queue, send)
+        self.sessions.append(session)
+        return session
+
+    def notify(self, session):
+        """
+        Called when a request was put in the queue of a session.
+        """
+        if not session.active and session in self.sessions:
+            session.active = True
+            self._active.append(session)
+        self._wakeup.set()
+
+    def remove_session(self, session):
+        if session in self.sessions:
+            self.sessions.remove(session)
+        if session.active:
+            self._active.remove(session)
+            session.active = False
+        if not session.closed.done():
+            session.closed.set_result(None)
+
+    async def run(self):
+        while True:
+            if not self._active:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            session = self._active[0]
+            if session.queue.empty():
+                self._active.popleft()
+                session.active = False
+                session.deficit = 0
+                continue
+
+            if session.deficit <= 0:
+                session.deficit += self.quantum
+                self._active.rotate(-1)
+                continue
+
+            message = session.queue.get_nowait()
+            if message.message_type == CLOSE_REQUEST:
+                self.remove_session(session)
+                continue
+
+            await self._wait_tokens()
+            size = await session.send(message)
+            self._tokens -= size
+
+            session.deficit -= size
+            session.bytes += size
+            session.tiles += 1
+            session.bytes_by_priority[message.priority] = session.bytes_by_priority.get(message.priority, 0) + size
+
+            # Let the sessions read their requests
+            await asyncio.sleep(0)
+
+    async def _wait_tokens(self):
+        if self.rate <= 0:
+            return
+
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._last_refill) * self.rate, self.burst)
+        self._last_refill = now
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+            self._tokens = 0
+            self._last_refill = time.monotonic()
+
+    def fair_rate(self):
+        """
+        Share of the egress rate of each open session, in bytes per second.
+        """
+        if self.rate <= 0:
+            return math.inf
+        return self.rate / max(len(self.sessions), 1)
+
+    def fairness(self):
+        """
+        Jain's index of the throughput of the open sessions.
+        """
+        return jain_index(session.throughput() for session in self.sessions)
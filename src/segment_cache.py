@@ -0,0 +1,167 @@
+import mmap
+from collections import OrderedDict
+
+import numpy as np
+
+from src.codec import LENGTH, encode_init_bundle
+from src.data_types import VideoPacket
+from src.utils import get_server_file_name
+from src.video_constants import INIT_SEGMENT
+
+CHUNK_SIZE = 1024
+
+
+def frame_file(file_name, chunk_size=CHUNK_SIZE):
+    """
+    Reads a whole segment file and returns (file size, framed data): the file split in length prefixed chunks,
+    followed by the empty chunk that marks the end of the file. A chunk size of 0 sends the file as a single chunk.
+    """
+    with open(file_name, "rb") as video_file:
+        return frame_data(video_file.read(), chunk_size)
+
+
+def frame_data(data, chunk_size=CHUNK_SIZE):
+    if chunk_size == 0:
+        chunk_size = max(len(data), 1)
+
+    framed = bytearray()
+    view = memoryview(data)
+    for offset in range(0, len(data), chunk_size):
+        chunk = view[offset:offset + chunk_size]
+        framed += LENGTH.pack(len(chunk))
+        framed += chunk
+    framed += LENGTH.pack(0)
+
+    return len(data), bytes(framed)
+
+
+class SharedSegments:
+    """
+    Every file of the manifest loaded once in an anonymous shared memory map, at its manifest offset. It is created
+    before the server workers are forked, so they all read the same physical pages instead of each keeping its own
+    copy of the video.
+    """
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self.size = manifest.total_size
+        self._map = mmap.mmap(-1, max(self.size, 1))
+
+        for key in zip(*np.nonzero(manifest.sizes)):
+            offset, size = int(manifest.offsets[key]), int(manifest.sizes[key])
+            with open(manifest.file_names[key], "rb") as video_file:
+                self._map[offset:offset + size] = video_file.read()
+        self._view = memoryview(self._map)
+
+    def get(self, segment, tile, bitrate):
+        location = self.manifest.locate(segment, tile, bitrate)
+        if location is None:
+            return None
+        offset, size = location
+        return self._view[offset:offset + size]
+
+
+class SegmentCache:
+    """
+    LRU cache of framed segment files, bounded by a byte budget. A budget of 0 disables caching, files are then read
+    from disk on every request (but still sent with a single write).
+
+    With shared segments, files are read from the shared memory map instead of the disk, and tiles sent as a single
+    chunk aren't copied at all: their body is the chunk length, a view of the shared memory and the end marker. With
+    a manifest, file names are looked up in it instead of being built for every tile.
+    """
+    def __init__(self, budget_bytes, segments=None, manifest=None):
+        self.budget_bytes = budget_bytes
+        self.segments = segments
+        self.manifest = manifest
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, segment, tile, bitrate, codec, chunk_size=CHUNK_SIZE):
+        """
+        Returns (header, body) for a tile: the framed segment header for the session codec and the buffers of the
+        file framed in chunks of the session chunk size.
+        """
+        key = (int(segment), int(tile), int(bitrate), chunk_size)
+        entry = self._entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            entry = self._load(segment, tile, bitrate, chunk_size)
+            self._insert(key, entry)
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+
+        size, body, headers, _ = entry
+        header = headers.get(codec.version)
+        if header is None:
+            header = bytes(codec.frame_header(VideoPacket(segment=segment, tile=tile, bitrate=bitrate, size=size)))
+            headers[codec.version] = header
+
+        return header, body
+
+    def get_init_bundle(self, tiles, bitrate, codec, chunk_size=CHUNK_SIZE):
+        """
+        Returns (header, body) for the init segments of tiles at bitrate, sent together. Bundles depend on what each
+        session already got, so they aren't cached.
+        """
+        size, framed = frame_data(encode_init_bundle((tile, self.read(INIT_SEGMENT, tile, bitrate)) for tile in tiles),
+                                  chunk_size)
+        header = bytes(codec.frame_header(VideoPacket(segment=INIT_SEGMENT, tile=0, bitrate=bitrate, size=size)))
+        return header, (framed,)
+
+    def read(self, segment, tile, bitrate):
+        """
+        Contents of a file, from the shared segments when there are.
+        """
+        data = self.segments.get(segment, tile, bitrate) if self.segments is not None else None
+        if data is not None:
+            return data
+        with open(self._file_name(segment, tile, bitrate), "rb") as video_file:
+            return video_file.read()
+
+    def _file_name(self, segment, tile, bitrate):
+        if self.manifest is not None:
+            return self.manifest.file_name(segment, tile, bitrate)
+        return get_server_file_name(segment=segment, tile=tile, bitrate=bitrate)
+
+    def _load(self, segment, tile, bitrate, chunk_size):
+        """
+        Cache entry of a tile: (file size, body buffers, headers by protocol version, bytes owned by the entry).
+        """
+        data = self.segments.get(segment, tile, bitrate) if self.segments is not None else None
+
+        if data is None:
+            size, framed = frame_file(self._file_name(segment, tile, bitrate), chunk_size)
+        elif chunk_size == 0 and len(data) > 0:
+            body = (LENGTH.pack(len(data)), data, LENGTH.pack(0))
+            return len(data), body, {}, 2 * LENGTH.size
+        else:
+            size, framed = frame_data(data, chunk_size)
+
+        return size, (framed,), {}, len(framed)
+
+    def _insert(self, key, entry):
+        entry_size = entry[3]
+        if entry_size > self.budget_bytes:
+            return
+
+        while self.size + entry_size > self.budget_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted[3]
+            self.evictions += 1
+
+        self._entries[key] = entry
+        self.size += entry_size
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.size,
+        }
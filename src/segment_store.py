@@ -0,0 +1,138 @@
+import mmap
+import os
+from collections import OrderedDict
+
+from src.utils import get_client_file_name
+from src.video_constants import CLIENT_RING_FILE
+
+FILE_STORE = 'file'
+MEMORY_STORE = 'memory'
+RING_STORE = 'ring'
+
+
+def segment_key(segment, tile, bitrate):
+    return int(segment), int(tile), int(bitrate)
+
+
+class FileSegmentStore:
+    """
+    Writes every tile to its own file, as received (no encoding), with a single vectored write.
+    """
+    def __init__(self):
+        self._keys = set()
+
+    def put(self, segment, tile, bitrate, *buffers):
+        fd = os.open(get_client_file_name(segment=segment, tile=tile, bitrate=bitrate),
+                     os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.writev(fd, buffers)
+        finally:
+            os.close(fd)
+        self._keys.add(segment_key(segment, tile, bitrate))
+
+    def exists(self, segment, tile, bitrate):
+        return segment_key(segment, tile, bitrate) in self._keys
+
+    def get(self, segment, tile, bitrate):
+        if not self.exists(segment, tile, bitrate):
+            return None
+        with open(get_client_file_name(segment=segment, tile=tile, bitrate=bitrate), "rb") as segment_file:
+            return segment_file.read()
+
+
+class MemorySegmentStore:
+    """
+    Keeps tiles in memory up to a byte budget, dropping the oldest ones first.
+    """
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.size = 0
+        self._tiles = OrderedDict()
+
+    def put(self, segment, tile, bitrate, *buffers):
+        data = b''.join(buffers)
+        key = segment_key(segment, tile, bitrate)
+        if key in self._tiles:
+            self.size -= len(self._tiles.pop(key))
+        if len(data) > self.budget_bytes:
+            return
+
+        while self.size + len(data) > self.budget_bytes:
+            _, evicted = self._tiles.popitem(last=False)
+            self.size -= len(evicted)
+
+        self._tiles[key] = data
+        self.size += len(data)
+
+    def exists(self, segment, tile, bitrate):
+        return segment_key(segment, tile, bitrate) in self._tiles
+
+    def get(self, segment, tile, bitrate):
+        return self._tiles.get(segment_key(segment, tile, bitrate))
+
+
+class RingSegmentStore:
+    """
+    Writes tiles one after the other in a single preallocated memory mapped file. When the end of the file is
+    reached writing wraps around, and the tiles that get overwritten are forgotten.
+    """
+    def __init__(self, size_bytes, file_name=CLIENT_RING_FILE):
+        self.size_bytes = size_bytes
+        self.position = 0
+        # Tiles in the order they were written, which is also their order in the ring: key -> (offset, size)
+        self._tiles = OrderedDict()
+
+        with open(file_name, "w+b") as ring_file:
+            ring_file.truncate(size_bytes)
+            self._map = mmap.mmap(ring_file.fileno(), size_bytes)
+
+    def put(self, segment, tile, bitrate, *buffers):
+        size = sum(len(buffer) for buffer in buffers)
+        key = segment_key(segment, tile, bitrate)
+        self._tiles.pop(key, None)
+        if size > self.size_bytes:
+            return
+
+        if self.position + size > self.size_bytes:
+            self._evict(self.position, self.size_bytes)
+            self.position = 0
+        self._evict(self.position, self.position + size)
+
+        offset = self.position
+        for buffer in buffers:
+            self._map[offset:offset + len(buffer)] = buffer
+            offset += len(buffer)
+
+        self._tiles[key] = (self.position, size)
+        self.position = offset
+
+    def _evict(self, start, end):
+        while self._tiles:
+            key, (offset, size) = next(iter(self._tiles.items()))
+            if offset >= end or offset + size <= start:
+                return
+            del self._tiles[key]
+
+    def exists(self, segment, tile, bitrate):
+        return segment_key(segment, tile, bitrate) in self._tiles
+
+    def get(self, segment, tile, bitrate):
+        location = self._tiles.get(segment_key(segment, tile, bitrate))
+        if location is None:
+            return None
+        offset, size = location
+        return self._map[offset:offset + size]
+
+    def close(self):
+        self._map.close()
+
+
+def create_store(store_type, budget_bytes):
+    if store_type == FILE_STORE:
+        return FileSegmentStore()
+    elif store_type == MEMORY_STORE:
+        return MemorySegmentStore(budget_bytes)
+    elif store_type == RING_STORE:
+        return RingSegmentStore(budget_bytes)
+    else:
+        raise ValueError('Unknown segment store: ' + str(store_type))
@@ -1,123 +1,209 @@
 import argparse
 import asyncio
-import struct
+import math
 import time
-from asyncio import Queue
 
 from aioquic.asyncio import serve
 from aioquic.quic.configuration import QuicConfiguration
-from src.queues import StrictPriorityQueue, WeightedFairQueue
-from src.data_types import VideoRequestMessage, VideoPacket
-from src.utils import message_to_QUICPacket, get_server_file_name
-from src.video_constants import CLOSE_REQUEST, TILE_REQUEST, LOW_PRIORITY, PUSH_REQUEST, WFQ_QUEUE, SP_QUEUE, N_SEGMENTS
+from src.codec import LENGTH, read_hello, encode_hello_ack, get_codec, negotiate_chunk_size
+from src.queues import create_queue, queue_item
+from src.data_types import VideoRequestMessage, VideoBatchPacket, PlaybackPosition, QUICPacket
+from src.scheduler import GlobalScheduler, QUANTUM
+from src.prediction import PopularityHeatmap, create_predictor, REPLAY_PREDICTOR
+from src.push import PushPlanner, PUSH_DEPTH
+from src.prefetch import segment_of
+from src.manifest import ManifestIndex, InitTracker
+from src.segment_cache import SegmentCache, SharedSegments, CHUNK_SIZE
+from src.bundles import SegmentBundles
+from src.streams import StreamPool, negotiate_streams
+from src.workers import ServerStats, serve_reuseport, start_workers
+from src.video_constants import CLOSE_REQUEST, TILE_REQUEST, INIT_REQUEST, HIGH_PRIORITY, LOW_PRIORITY, PUSH_REQUEST, N_SEGMENTS, \
+    PROTOCOL_TEXT, WFQ_WEIGHTS, EDF_QUEUE, DROP_EXPIRED, SEGMENT_TIME, INIT_SEGMENT
 
 
 def handle_stream(reader, writer):
     asyncio.ensure_future(handle_echo(reader, writer))
 
 async def handle_echo(reader, writer):
-    closed = False
-
-    if Queue_Type == WFQ_QUEUE:
-        queue = WeightedFairQueue()
-    elif Queue_Type == SP_QUEUE:
-        queue = StrictPriorityQueue()
-    else:
-        queue = Queue()
-
-    name = await reader.read(1024)
-
-    print("Connection with "+str(name.decode()))
-
-    asyncio.ensure_future(receive(reader, queue))
-    while not closed:
-        video_request = await queue.get()
-        if video_request.message_type == CLOSE_REQUEST:
-            closed = True
-        else:
-            await send(video_request, writer)
-
-async def receive(reader, queue):
-    last_segment = 1
-    tiles_priority = Queue()
-    segment = 1
-    closed = False
-
-    while not closed:
+    queue = create_queue(Queue_Type, Wfq_Weights, Edf_Expired)
+
+    name, version, max_chunk, n_streams = await read_hello(reader)
+    codec = get_codec(version)
+    chunk_size = negotiate_chunk_size(Chunk_Size, max_chunk)
+    n_streams = negotiate_streams(Streams, n_streams)
+    if codec.version != PROTOCOL_TEXT:
+        writer.write(encode_hello_ack(codec.version, chunk_size, n_streams))
+
+    streams = StreamPool(writer.transport.protocol, writer, n_streams)
+    await streams.open()
+    Stats.add('connections')
+    Stats.add('sessions')
+
+    print("Connection with "+str(name)+" (protocol "+str(codec.version)+", chunk size "+str(chunk_size)+
+          ", streams "+str(n_streams)+")")
+
+    session = Scheduler.add_session(name, queue, lambda message: send(message, streams, codec, chunk_size))
+    asyncio.ensure_future(receive(reader, session, codec))
+
+    # The scheduler sends the tiles of all the sessions, until it gets to the close request of this one
+    await session.closed
+
+    print("Session "+str(name)+": "+str(session.stats())+", fairness (Jain): "+str(round(Scheduler.fairness(), 3)))
+    streams.close()
+    Stats.add('sessions', -1)
+    print("Segment cache: "+str(Segment_Cache.stats()))
+    if Queue_Type == EDF_QUEUE:
+        Stats.add('expired', queue.dropped + queue.demoted)
+        print("Expired tiles: "+str(queue.stats()))
+
+def enqueue(session, message_type, priority, segment, tile, bitrate):
+    enqueue_message(session, VideoRequestMessage(message_type, segment, tile, bitrate, priority))
+
+def enqueue_inits(session, codec, bundle):
+    """
+    Init bundles only go to binary clients, text clients get the init segments of the bundle one by one, as tiles of
+    segment INIT_SEGMENT.
+    """
+    if codec.version != PROTOCOL_TEXT:
+        enqueue_message(session, bundle)
+        return
+    for tile in bundle.tiles:
+        enqueue(session, TILE_REQUEST, bundle.priority, INIT_SEGMENT, tile, bundle.bitrate)
+
+def enqueue_message(session, message):
+    # Requests are weighed by the bytes they are answered with, as in the simulator
+    session.queue.put_nowait(queue_item(Queue_Type, message, Manifest.payload_size(message)))
+    Scheduler.notify(session)
+
+async def receive(reader, session, codec):
+    planner = PushPlanner(Push_Depth, create_predictor(Predictor, Heatmap))
+    inits = InitTracker(Manifest)
+
+    while True:
         try:
-            read_data = await asyncio.wait_for(reader.readexactly(4), timeout=0.01)
-            size, = struct.unpack('<L', read_data)
+            size, = LENGTH.unpack(await reader.readexactly(4))
 
             message_data = await reader.readexactly(size)
 
-            message = message_to_QUICPacket(eval(message_data.decode()))
-
-            if message.end_stream:
-                message_type = CLOSE_REQUEST
-
-                priority = LOW_PRIORITY
-                segment = 0
-                tile = 0
-                bitrate = 0
-
-                closed = True
-            else:
-                message_type = TILE_REQUEST
-
-                segment = message.video_packet.segment
-                priority = message.video_packet.priority
-                tile = message.video_packet.tile
-                bitrate = message.video_packet.bitrate
-
-                print("Received bitrate: "+str(bitrate))
-
-                if segment != last_segment:
-                    tiles_priority = Queue()
-                    last_segment = segment
-
-                tiles_priority.put_nowait((priority, tile, bitrate))
-
-        except asyncio.TimeoutError:
-            if segment == last_segment:
-                segment += 1
-
-            priority, tile, bitrate = await tiles_priority.get()
-            message_type = PUSH_REQUEST
-
-        if segment <= N_SEGMENTS:
-            data = VideoRequestMessage(message_type, segment, tile, bitrate)
-            if Queue_Type == WFQ_QUEUE:
-                queue.put_nowait((priority, size, data))
-            elif Queue_Type == SP_QUEUE:
-                queue.put_nowait((priority, data))
-            else:
-                queue.put_nowait(data)
-
-async def send(message: VideoRequestMessage, writer):
-    segment = message.segment
-    tile = message.tile
-    bitrate = message.bitrate
-
-    video_info = VideoPacket(segment=segment, tile=tile, bitrate=bitrate)
-    data = video_info.serialize()
-
-    writer.write(struct.pack('<L', len(data)))
-    writer.write(data)
-
-    file_name = get_server_file_name(segment=segment, tile=tile, bitrate=bitrate)
+            message = codec.decode_request(message_data)
+        except asyncio.IncompleteReadError:
+            # The client went away without closing the session, it must still leave the scheduler
+            message = QUICPacket(stream_id=None, end_stream=True)
+
+        if isinstance(message.video_packet, PlaybackPosition):
+            if Queue_Type == EDF_QUEUE:
+                session.queue.report_position(message.video_packet.frame, message.video_packet.fps)
+            # The client may request nothing for a segment that was pushed, the pushes go on from the one played
+            segment = segment_of(message.video_packet.frame)
+            if segment <= N_SEGMENTS:
+                enqueue_pushes(session, codec, planner, inits, segment, [])
+            continue
+
+        if message.end_stream:
+            enqueue(session, CLOSE_REQUEST, LOW_PRIORITY, 0, 0, 0)
+            return
+
+        video_packet = message.video_packet
+        segment = video_packet.segment
+
+        if isinstance(video_packet, VideoBatchPacket):
+            requests = [(HIGH_PRIORITY, tile, video_packet.bitrate) for tile in video_packet.high_priority_tiles]
+            requests += [(LOW_PRIORITY, tile, video_packet.bitrate) for tile in video_packet.low_priority_tiles]
+        else:
+            requests = [(video_packet.priority, video_packet.tile, video_packet.bitrate)]
+
+        print("Received bitrate: "+str(video_packet.bitrate))
+
+        if segment > N_SEGMENTS:
+            continue
+
+        # Tiles that aren't in the manifest would only fail when sent
+        known = [request for request in requests if Manifest.exists(segment, request[1], request[2])]
+        if len(known) < len(requests):
+            Stats.add('rejected', len(requests) - len(known))
+            requests = known
+
+        # Init segments go before the first tiles needing them
+        for bundle in inits.bundles(segment, requests):
+            enqueue_inits(session, codec, bundle)
+
+        for priority, tile, bitrate in requests:
+            # Tiles already pushed are on their way
+            if not planner.was_pushed(segment, tile, bitrate):
+                enqueue(session, TILE_REQUEST, priority, segment, tile, bitrate)
+
+        enqueue_pushes(session, codec, planner, inits, segment, requests)
+
+def enqueue_pushes(session, codec, planner, inits, segment, requests):
+    """
+    Queues the tiles planned to be pushed after the requests of segment (none when it is only being played), with the
+    init segments they need.
+    """
+    pushes = [push for push in planner.plan(segment, requests, *push_budget(session))
+              if Manifest.exists(push[0], push[2], push[3])]
+    for bundle in inits.bundles(segment, [push[1:] for push in pushes]):
+        enqueue_inits(session, codec, bundle)
+    for push_segment, priority, tile, bitrate in pushes:
+        enqueue(session, PUSH_REQUEST, priority, push_segment, tile, bitrate)
+
+def push_budget(session):
+    """
+    Bytes that can be pushed to a session, and the average size of its tiles: what its share of the egress rate sends
+    over the push depth, less what is already waiting in its queue. Without an egress rate, its share is the
+    throughput the session got so far.
+    """
+    tile_bytes = session.bytes / session.tiles if session.tiles else 0
+    rate = Scheduler.fair_rate()
+    if math.isinf(rate):
+        rate = session.throughput()
+    budget = rate * SEGMENT_TIME * Push_Depth - session.queue.qsize() * tile_bytes
+    return budget, tile_bytes
+
+async def send(message: VideoRequestMessage, streams: StreamPool, codec, chunk_size):
+    if message.message_type == INIT_REQUEST:
+        header, body = Segment_Cache.get_init_bundle(message.tiles, message.bitrate, codec, chunk_size)
+    else:
+        header, body = Segment_Cache.get(message.segment, message.tile, message.bitrate, codec, chunk_size)
+
+    writer = streams.writer_for(message.priority) or await streams.create_writer()
+    writer.write(header)
+    for buffer in body:
+        writer.write(buffer)
+    streams.release(writer)
+
+    size = len(header) + sum(len(buffer) for buffer in body)
+    Stats.add('tiles')
+    Stats.add('bytes', size)
+    Stats.set('cache_hits', Segment_Cache.hits)
+    Stats.set('cache_misses', Segment_Cache.misses)
+    return size
+
+def run_worker(worker, args, configuration, segments, stats):
+    """
+    Runs one server process. With more than one worker each binds its own SO_REUSEPORT socket to the server port.
+    """
+    global Segment_Cache
+    Segment_Cache = SegmentCache(args.cache_mb * 1024 * 1024, segments, Manifest)
+
+    global Stats
+    Stats = stats.worker(worker)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    global Scheduler
+    Scheduler = GlobalScheduler(args.quantum, args.egress_mbps * 1000000 / 8)
+    asyncio.ensure_future(Scheduler.run())
+
+    if args.workers > 1:
+        loop.run_until_complete(serve_reuseport(args.host, args.port, configuration, handle_stream))
+    else:
+        loop.run_until_complete(serve(args.host, args.port, configuration=configuration,
+                                      stream_handler=handle_stream))
+        if args.stats_port:
+            loop.run_until_complete(stats.serve(args.host, args.stats_port))
 
-    with open(file_name, "rb") as video_file:
-        not_finished = True
-        chunk_n = 1
-        while not_finished:
-            chunk = video_file.read(1024)
-            if not chunk:
-                writer.write(struct.pack('<L', 0))
-                not_finished = False
-            else:
-                writer.write(struct.pack('<L', len(chunk)))
-                writer.write(chunk)
-                chunk_n+=1
+    loop.run_forever()
 
 
 if __name__ == "__main__":
@@ -154,13 +240,120 @@ if __name__ == "__main__":
         "--queue",
         type=str,
         default="FIFO",
-        help="the type of Queuing used by the server",
+        help="the type of Queuing used by the server (options: FIFO, SP, WFQ, EDF)",
+    )
+    parser.add_argument(
+        "--wfq-weights",
+        type=str,
+        default=",".join(str(weight) for weight in WFQ_WEIGHTS),
+        help="comma separated bandwidth shares of the WFQ priority classes, from the highest priority down (defaults "
+             "to 0.75,0.25)",
+    )
+    parser.add_argument(
+        "--edf-expired",
+        type=str,
+        default=DROP_EXPIRED,
+        help="what the EDF queue does with tiles whose playout deadline passed (options: drop, demote = send them "
+             "after the others) - (defaults to drop)",
+    )
+    parser.add_argument(
+        "--push-depth",
+        type=int,
+        default=PUSH_DEPTH,
+        help="number of segments ahead of each request whose tiles are pushed, 0 disables pushes (defaults to 1)",
+    )
+    parser.add_argument(
+        "--predictor",
+        type=str,
+        default=REPLAY_PREDICTOR,
+        help="how pushed tiles are chosen (options: replay = the tiles of the last request, last, linear, heatmap, "
+             "hybrid = viewport predictors) - (defaults to replay)",
+    )
+    parser.add_argument(
+        "--cache-mb",
+        type=int,
+        default=64,
+        help="memory budget of the segment cache in MB, 0 disables it (defaults to 64)",
+    )
+    parser.add_argument(
+        "--bundles",
+        type=str,
+        default="",
+        help="serve the tiles from the bundle files of this directory (written by src.bundles) instead of one file "
+             "per tile",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=CHUNK_SIZE,
+        help="size of the chunks tiles are split in, 0 sends each tile as a single chunk (defaults to 1024)",
+    )
+    parser.add_argument(
+        "--streams",
+        type=int,
+        default=0,
+        help="most data streams per session: 1 sends everything on the client stream, 0 also allows a new stream "
+             "per tile (defaults to 0)",
+    )
+    parser.add_argument(
+        "--quantum",
+        type=int,
+        default=QUANTUM,
+        help="bytes each session may send per round of the scheduler shared by all sessions (defaults to 16384)",
+    )
+    parser.add_argument(
+        "--egress-mbps",
+        type=float,
+        default=0,
+        help="egress rate budget of the server (of each worker) in Mbit/s, needed for the sessions to get fair shares, "
+             "0 = unlimited (defaults to 0)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of server processes sharing the port and the segment data (defaults to 1)",
+    )
+    parser.add_argument(
+        "--stats-port",
+        type=int,
+        default=0,
+        help="serve the connection and byte counters of all workers as JSON over HTTP on this port (disabled by "
+             "default)",
     )
     args = parser.parse_args()
 
     global Queue_Type
     Queue_Type = args.queue
 
+    global Wfq_Weights
+    Wfq_Weights = [float(weight) for weight in args.wfq_weights.split(",")]
+    if any(weight <= 0 for weight in Wfq_Weights):
+        parser.error("--wfq-weights must all be positive")
+
+    global Edf_Expired
+    Edf_Expired = args.edf_expired
+
+    global Push_Depth
+    Push_Depth = args.push_depth
+
+    global Predictor
+    Predictor = args.predictor
+
+    # Shared by all the sessions of a worker
+    global Heatmap
+    Heatmap = PopularityHeatmap()
+
+    global Chunk_Size
+    Chunk_Size = args.chunk_size
+
+    global Streams
+    Streams = args.streams
+
+    # Built before forking, so the workers share it
+    global Manifest
+    Manifest = ManifestIndex.load()
+
     configuration = QuicConfiguration(
         is_client=False,
         max_datagram_frame_size=65536
@@ -168,13 +361,25 @@ if __name__ == "__main__":
 
     configuration.load_cert_chain(args.certificate, args.private_key)
 
-    asyncio.ensure_future(
-        serve(args.host,
-              args.port,
-              configuration=configuration,
-              stream_handler=handle_stream
-        )
-    )
+    stats = ServerStats(max(args.workers, 1))
 
-    loop = asyncio.get_event_loop()
-    loop.run_forever()
\ No newline at end of file
+    if args.bundles:
+        # Mapped before forking, the workers share the pages of the files
+        segments = SegmentBundles(args.bundles)
+        print("Bundles: "+str(len(segments))+" files, "+str(segments.size)+" bytes")
+    elif args.workers > 1:
+        # Loaded before forking, so the workers share it
+        segments = SharedSegments(Manifest)
+        print("Shared segments: "+str(segments.size)+" bytes, "+str(args.workers)+" workers")
+    else:
+        segments = None
+
+    if args.workers > 1:
+        start_workers(args.workers, run_worker, args, configuration, segments, stats)
+
+        loop = asyncio.get_event_loop()
+        if args.stats_port:
+            loop.run_until_complete(stats.serve(args.host, args.stats_port))
+        loop.run_forever()
+    else:
+        run_worker(0, args, configuration, segments, stats)
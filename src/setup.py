@@ -52,6 +52,10 @@ def main(video_url: str):
     os.system("MP4Box -dash 1000 -rap -frag-rap -profile live -out \"../data/segments/dash_tiled_5.mpd\""
               " \"../data/video_encoding/video_tiled_5.mp4\"")
 
+    # Pack the tiles of each segment and bitrate in a bundle file
+    os.system("rm -rf ../data/bundles")
+    os.system("cd .. && python3 -m src.bundles -o data/bundles/")
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Video encoding setup")
@@ -0,0 +1,359 @@
+import argparse
+import bisect
+import contextlib
+import csv
+import heapq
+import io
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.buffer import Buffer
+from src.dash import Dash, BASIC, BOLA
+from src.data_types import VideoRequestMessage
+from src.manifest import ManifestIndex, InitTracker
+from src.measurement import ThroughputMeter
+from src.queues import create_queue, queue_item
+from src.report import PlaybackReport
+from src.tile_index import TileIndex
+from src.viewport import ViewportTrace, PackedTraces, complement, is_packed
+from src.video_constants import BITRATES, N_SEGMENTS, VIDEO_FPS, FRAME_TIME_MS, SEGMENT_TIME, \
+    HIGH_PRIORITY, LOW_PRIORITY, TILE_REQUEST, INIT_REQUEST, FIFO_QUEUE, EDF_QUEUE, WFQ_WEIGHTS, DROP_EXPIRED
+
+# Link of the Mininet topology (mininet_config.py): 100 Mbps with 100 ms of delay
+BANDWIDTH = 100.0
+RTT = 0.2
+# Bytes sent with every tile besides the segment file: length prefixes and header
+TILE_OVERHEAD = 32
+
+# Events, in the order they are handled when due at the same time
+DELIVER = 0
+SENT = 1
+ARRIVE = 2
+PLAY = 3
+REQUEST = 4
+
+
+class BandwidthTrace:
+    """
+    Piecewise constant link rate: from times[i] (in seconds) the link sends rates[i] Mbps, the last rate holding
+    until the end. The link may be down for a while (a rate of 0), but not for good: the last rate must be positive.
+    """
+    def __init__(self, times, rates):
+        if not rates or rates[-1] <= 0 or min(rates) < 0:
+            raise ValueError('Bandwidth trace rates must not be negative, and the last one must be positive: '
+                             + str(list(rates)))
+        self.times = [float(time) for time in times]
+        self.rates = [float(rate) * 1000000 / 8 for rate in rates]  # Bytes per second
+
+    @classmethod
+    def constant(cls, mbps):
+        return cls([0.0], [mbps])
+
+    @classmethod
+    def read(cls, file_name):
+        """
+        CSV file with a (time in seconds, Mbps) row for every change of the rate.
+        """
+        times, rates = [], []
+        with open(file_name) as csv_file:
+            for row in csv.reader(csv_file):
+                try:
+                    times.append(float(row[0]))
+                    rates.append(float(row[1]))
+                except (ValueError, IndexError):
+                    continue
+        return cls(times, rates)
+
+    def finish_time(self, start, size):
+        """
+        Time at which size bytes started sending at start are sent.
+        """
+        index = max(bisect.bisect_right(self.times, start) - 1, 0)
+        time = start
+        while True:
+            rate = self.rates[index]
+            end = self.times[index + 1] if index + 1 < len(self.times) else float('inf')
+            if rate > 0 and time + size / rate <= end:
+                return time + size / rate
+            size -= rate * (end - time)
+            time = end
+            index += 1
+
+
+class Simulation:
+    """
+    Discrete event simulation of a session in virtual time: the client logic of client.py (the adaptation
+    algorithm, FOV first requests at the start of each segment, the missing ratio of every frame played) against a
+    server with one of the request queues sending the tiles one after the other on a link following the bandwidth
+    trace, with the real tile sizes of the manifest. Requests and tiles take half the RTT each way.
+    """
+    def __init__(self, viewports, manifest, algorithm=BASIC, queue_type=FIFO_QUEUE, bandwidth=None, rtt=RTT,
+                 n_segments=N_SEGMENTS, weights=WFQ_WEIGHTS, expired=DROP_EXPIRED):
+        self.viewports = viewports
+        self.manifest = manifest
+        self.bandwidth = bandwidth or BandwidthTrace.constant(BANDWIDTH)
+        self.rtt = rtt
+        self.n_segments = n_segments
+        self.frame_time = FRAME_TIME_MS / 1000000
+
+        self.dash = Dash(BITRATES, algorithm)
+        self.tile_index = TileIndex(self.dash.bitrates, n_segments)
+        self.buffer = Buffer(n_segments, SEGMENT_TIME)
+        self.meter = ThroughputMeter()
+        self.report = PlaybackReport(n_segments)
+        self.queue_type = queue_type
+        self.queue = create_queue(queue_type, weights, expired, clock=lambda: self.now)
+        self.inits = InitTracker(manifest)
+
+        self.now = 0.0
+        self.link_busy = False
+        self._events = []
+        self._order = itertools.count()
+
+    def schedule(self, time, kind, data=None):
+        heapq.heappush(self._events, (time, kind, next(self._order), data))
+
+    def run(self):
+        # Frame f is played at f frame times, the requests made with it are sent right after the previous one
+        last_frame = min(self.n_segments * VIDEO_FPS + 1, len(self.viewports))
+        for frame in range(1, last_frame + 1):
+            self.schedule((frame - 1) * self.frame_time, REQUEST, frame)
+            self.schedule(frame * self.frame_time, PLAY, frame)
+
+        self.segment = 0
+        self.segment_bitrates = None
+        while self._events:
+            self.now, kind, _, data = heapq.heappop(self._events)
+            if kind == REQUEST:
+                self.frame(data)
+            elif kind == PLAY:
+                self.play(data)
+            elif kind == ARRIVE:
+                self.arrive(data)
+            elif kind == SENT:
+                self.link_busy = False
+                self.send_next()
+            else:
+                self.deliver(*data)
+        self.buffer.finish()
+        return self
+
+    def frame(self, frame):
+        fov = self.viewports.tiles[frame]
+        fov_mask = self.viewports.masks[frame]
+
+        if (frame - 1) % (SEGMENT_TIME * VIDEO_FPS) == 0:
+            self.segment += 1
+            self.dash.update_buffer_level(self.buffer.occupancy(fov))
+            self.segment_bitrates = self.dash.get_tile_bitrates(self.segment, fov_mask,
+                                                                self.manifest.tile_sizes(self.segment))
+            self.segment_bitrates[fov_mask & (self.segment_bitrates == 0)] = self.dash.bitrates[0]
+            missing = self.tile_index.unrequested(self.segment, self.segment_bitrates)
+            self.request(frame, np.flatnonzero(missing & fov_mask), np.flatnonzero(missing & complement(fov_mask)))
+
+        # Tiles coming into view that were left out of the segment are fetched at the lowest bitrate
+        skipped = fov_mask & (self.segment_bitrates == 0)
+        if skipped.any():
+            self.segment_bitrates[skipped] = self.dash.bitrates[0]
+            self.request(frame, np.flatnonzero(skipped), [])
+
+    def play(self, frame):
+        self.buffer.play((frame - 1) / VIDEO_FPS, self.viewports.tiles[frame])
+        self.report.add_frame(self.segment, self.tile_index.missing(self.segment, self.segment_bitrates),
+                              self.viewports.masks[frame])
+
+    def request(self, frame, high_priority_tiles, low_priority_tiles):
+        tiles = np.concatenate((high_priority_tiles, low_priority_tiles)).astype(int)
+        self.tile_index.request(self.segment, tiles, self.segment_bitrates)
+        for goodput in self.meter.request(self.segment, tiles, self.segment_bitrates, self.now):
+            self.dash.update_goodput(goodput)
+        requests = [(HIGH_PRIORITY, int(tile), int(self.segment_bitrates[tile])) for tile in high_priority_tiles]
+        requests += [(LOW_PRIORITY, int(tile), int(self.segment_bitrates[tile])) for tile in low_priority_tiles]
+        self.schedule(self.now + self.rtt / 2, ARRIVE, (frame, self.segment, requests))
+
+    def arrive(self, data):
+        frame, segment, requests = data
+        if self.queue_type == EDF_QUEUE:
+            self.queue.report_position(frame, 1 / self.frame_time)
+        if segment <= self.n_segments:
+            for bundle in self.inits.bundles(segment, requests):
+                self.queue.put_nowait(queue_item(self.queue_type, bundle, self.manifest.payload_size(bundle)))
+            for priority, tile, bitrate in requests:
+                message = VideoRequestMessage(TILE_REQUEST, segment, tile, bitrate, priority)
+                self.queue.put_nowait(queue_item(self.queue_type, message, self.manifest.payload_size(message)))
+        self.send_next()
+
+    def tile_size(self, message):
+        return self.manifest.payload_size(message) + TILE_OVERHEAD
+
+    def send_next(self):
+        if self.link_busy or self.queue.empty():
+            return
+        message = self.queue.get_nowait()
+        size = self.tile_size(message)
+        finish = self.bandwidth.finish_time(self.now, size)
+        self.link_busy = True
+        self.schedule(finish, SENT)
+        self.schedule(finish + self.rtt / 2, DELIVER, (message, self.now + self.rtt / 2, finish + self.rtt / 2,
+                                                       size - TILE_OVERHEAD))
+
+    def deliver(self, message, first_byte, last_byte, size):
+        if message.message_type == INIT_REQUEST:
+            return
+        self.tile_index.add(message.segment, message.tile, message.bitrate)
+        self.buffer.write(message.segment, message.tile)
+        self.dash.append_download_size(size)
+        self.dash.update_download_time(last_byte - first_byte, message.segment)
+        goodput = self.meter.record(message.segment, message.tile, message.bitrate, first_byte, last_byte, size)
+        if goodput is not None:
+            self.dash.update_goodput(goodput)
+
+    def summary(self):
+        missing, missing_fov = self.report.missing_ratio()
+        bitrates = [self.dash.bitrates_seg.get(segment, 0) for segment in range(1, self.n_segments + 1)]
+        return {
+            'missing_ratio': missing,
+            'missing_ratio_fov': missing_fov,
+            'bitrate': round(sum(bitrates) / self.n_segments, 2),
+            'download_time': round(self.dash.total_download_time, 2),
+            'stalls': self.buffer.stall_count(),
+            'rebuffering': round(self.buffer.rebuffering_time(), 2),
+        }
+
+    def print(self):
+        self.report.print(self.dash, self.buffer, self.meter)
+
+
+def load_inputs(user_input, users):
+    """
+    Reads the inputs shared by the simulations of a process: the traces of the users replayed, only their frames
+    being read from a binary trace file.
+    """
+    global Viewports, Manifest
+    Viewports = {user: ViewportTrace.read(user_input, user) for user in users}
+    Manifest = ManifestIndex.load()
+
+def bandwidth_trace(bandwidth):
+    """
+    Trace of a link rate in Mbps, or read from the CSV file bandwidth names.
+    """
+    if isinstance(bandwidth, str):
+        return BandwidthTrace.read(bandwidth)
+    return BandwidthTrace.constant(bandwidth)
+
+def simulate(configuration):
+    """
+    Runs the simulation of a (user, algorithm, queue, bandwidth, RTT in ms) configuration, the bandwidth being in Mbps
+    or the name of a bandwidth trace. Returns the configuration, the summary and the report the client would print.
+    """
+    user, algorithm, queue_type, bandwidth, rtt = configuration
+    simulation = Simulation(Viewports[user], Manifest, algorithm, queue_type, bandwidth_trace(bandwidth),
+                            rtt / 1000).run()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        simulation.print()
+    return configuration, simulation.summary(), output.getvalue()
+
+def parse_list(value, convert=str):
+    return [convert(item) for item in value.split(",") if item]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trace driven simulation of streaming sessions in virtual time")
+    parser.add_argument(
+        "-i",
+        "--user-input",
+        type=str,
+        default="data/user_input.csv",
+        help="CSV file with the head trace replayed, or binary trace file written by src.viewport (defaults to "
+             "data/user_input.csv)",
+    )
+    parser.add_argument(
+        "--users",
+        type=str,
+        default="0",
+        help="comma separated users of a binary trace file replayed, or all for every one (defaults to 0)",
+    )
+    parser.add_argument(
+        "-da",
+        "--dash-algorithm",
+        type=str,
+        default=BASIC,
+        help="comma separated dash algorithms to simulate (defaults to basic)",
+    )
+    parser.add_argument(
+        "-q",
+        "--queue",
+        type=str,
+        default=FIFO_QUEUE,
+        help="comma separated server queues to simulate (options: FIFO, SP, WFQ, EDF) - (defaults to FIFO)",
+    )
+    parser.add_argument(
+        "--bandwidth",
+        type=str,
+        default=str(int(BANDWIDTH)),
+        help="comma separated link rates in Mbps (defaults to 100)",
+    )
+    parser.add_argument(
+        "--bandwidth-trace",
+        type=str,
+        default="",
+        help="comma separated CSV files with a (time in seconds, Mbps) row for every change of the link rate, "
+             "simulated besides the constant rates",
+    )
+    parser.add_argument(
+        "--rtt",
+        type=str,
+        default=str(int(RTT * 1000)),
+        help="comma separated round trip times in ms, constant over a simulation (defaults to 200)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="processes running the simulations (defaults to the number of CPUs)",
+    )
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help="print the whole client report of every configuration, not only its summary",
+    )
+    args = parser.parse_args()
+
+    bandwidths = parse_list(args.bandwidth, float) + parse_list(args.bandwidth_trace)
+    for bandwidth in bandwidths:
+        try:
+            bandwidth_trace(bandwidth)
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+    if args.users == "all":
+        users = list(range(len(PackedTraces(args.user_input)))) if is_packed(args.user_input) else [0]
+    else:
+        users = parse_list(args.users, int)
+    algorithms = parse_list(args.dash_algorithm)
+    if BOLA in algorithms:
+        parser.error(BOLA + " adapts to the buffer ahead of playback, which the simulated client doesn't prefetch")
+    configurations = list(itertools.product(users, algorithms, parse_list(args.queue), bandwidths,
+                                            parse_list(args.rtt, float)))
+
+    if args.workers > 1 and len(configurations) > 1:
+        with ProcessPoolExecutor(args.workers, initializer=load_inputs, initargs=(args.user_input, users)) as executor:
+            chunk_size = max(len(configurations) // (4 * args.workers), 1)
+            results = list(executor.map(simulate, configurations, chunksize=chunk_size))
+    else:
+        load_inputs(args.user_input, users)
+        results = [simulate(configuration) for configuration in configurations]
+
+    print("user".ljust(6) + "algorithm".ljust(10) + "queue".ljust(6) + "bandwidth".rjust(16) + "rtt".rjust(8) + "missing".rjust(10) +
+          "missing fov".rjust(13) + "bitrate".rjust(9) + "stalls".rjust(8) + "rebuffering".rjust(13))
+    for (user, algorithm, queue_type, bandwidth, rtt), summary, report in results:
+        if args.report:
+            print(report)
+        bandwidth = os.path.basename(bandwidth) if isinstance(bandwidth, str) else str(bandwidth) + " Mbps"
+        print(str(user).ljust(6) + algorithm.ljust(10) + queue_type.ljust(6) + bandwidth.rjust(16) + (str(int(rtt)) + "ms").rjust(8) +
+              (str(summary['missing_ratio']) + "%").rjust(10) + (str(summary['missing_ratio_fov']) + "%").rjust(13) +
+              str(summary['bitrate']).rjust(9) + str(summary['stalls']).rjust(8) +
+              (str(summary['rebuffering']) + "s").rjust(13))
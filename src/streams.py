@@ -0,0 +1,96 @@
+import asyncio
+import itertools
+from collections import deque
+
+from src.video_constants import HIGH_PRIORITY
+
+# Streams opened ahead in per tile mode, enough for the tiles sent before the task replacing them runs
+SPARE_STREAMS = 4
+
+
+def negotiate_streams(server_streams, client_streams):
+    """
+    Number of data streams of a session. 1 keeps everything on the stream opened by the client, 0 opens a new stream
+    for every tile and any other value is the size of a pool of streams. The server value is an upper bound, with 0
+    allowing anything.
+    """
+    if server_streams == 1 or client_streams == 1:
+        return 1
+    if server_streams == 0:
+        return client_streams
+    if client_streams == 0:
+        return server_streams
+    return min(server_streams, client_streams)
+
+
+class StreamPool:
+    """
+    Server side writers of a session.
+
+    In pool mode half the streams (at least one) only carry high priority (FOV) tiles and the others carry the rest,
+    tiles being spread round robin over the streams of their class. A lost packet then only delays the tiles queued
+    on the same stream, instead of everything sent after it. QUIC has no stream priorities in aioquic, but its sender
+    serves streams in creation order, so the FOV streams are created first.
+
+    In per tile mode a few streams are kept open ahead, the one taken for a tile being replaced by a task of its own,
+    so the scheduler never waits for a stream to be created while the other sessions wait for it.
+    """
+    def __init__(self, protocol, control_writer, n_streams):
+        self.protocol = protocol
+        self.control_writer = control_writer
+        self.n_streams = n_streams
+        self.per_tile = n_streams == 0
+        self._writers = []
+        self._high_priority = None
+        self._low_priority = None
+        self._spare = deque()
+
+    async def open(self):
+        if self.per_tile:
+            await self.reserve()
+        if self.n_streams < 2:
+            return
+
+        n_high = max(self.n_streams // 2, 1)
+        self._writers = [await self.create_writer() for _ in range(self.n_streams)]
+        self._high_priority = itertools.cycle(self._writers[:n_high])
+        self._low_priority = itertools.cycle(self._writers[n_high:])
+
+    async def create_writer(self):
+        _, writer = await self.protocol.create_stream(is_unidirectional=True)
+        # The stream id is only taken once something is sent on it, otherwise the next stream would get the same id
+        writer.write(b'')
+        return writer
+
+    async def reserve(self):
+        """
+        In per tile mode, opens streams until SPARE_STREAMS of them are waiting to be used.
+        """
+        while self.per_tile and len(self._spare) < SPARE_STREAMS:
+            self._spare.append(await self.create_writer())
+
+    def writer_for(self, priority):
+        """
+        Writer of a tile, None in per tile mode when no stream was reserved for it.
+        """
+        if self.n_streams == 1:
+            return self.control_writer
+        if self.per_tile:
+            if not self._spare:
+                return None
+            asyncio.ensure_future(self.reserve())
+            return self._spare.popleft()
+        if priority == HIGH_PRIORITY:
+            return next(self._high_priority)
+        return next(self._low_priority)
+
+    def release(self, writer):
+        """
+        Called once a tile was written, closes the per tile streams.
+        """
+        if self.per_tile:
+            writer.write_eof()
+
+    def close(self):
+        for writer in self._writers + list(self._spare):
+            writer.write_eof()
@@ -0,0 +1,83 @@
+import numpy as np
+
+from src.video_constants import N_SEGMENTS, MAX_TILE
+
+
+class TileIndex:
+    """
+    Which tiles were delivered to the client, and which were requested, as boolean arrays indexed by (segment, tile,
+    bitrate). Tile numbers are used as indexes directly, so index 0 of the tile axis is never set.
+    """
+    def __init__(self, bitrates, n_segments=N_SEGMENTS, n_tiles=MAX_TILE):
+        self.bitrates = list(bitrates)
+        self._bitrate_index = {int(bitrate): index for index, bitrate in enumerate(self.bitrates)}
+        # Bitrate -> bitrate index, -1 for bitrates not in the ladder
+        self._level_of = np.full(max(self._bitrate_index) + 1, -1)
+        self._level_of[list(self._bitrate_index)] = list(self._bitrate_index.values())
+        self.delivered = np.zeros((n_segments + 1, n_tiles, len(self.bitrates)), dtype=bool)
+        self.requested = np.zeros_like(self.delivered)
+
+    def _locate(self, segment, bitrate):
+        segment = int(segment)
+        bitrate_index = self._bitrate_index.get(int(bitrate))
+        if bitrate_index is None or not 0 <= segment < self.delivered.shape[0]:
+            return None
+        return segment, bitrate_index
+
+    def _levels(self, bitrate):
+        """
+        Bitrate index of every tile for a bitrate, or an array of per tile bitrates, -1 where it isn't in the ladder
+        (0 marks a tile that isn't fetched at all).
+        """
+        bitrates = np.broadcast_to(np.asarray(bitrate).astype(int), (self.delivered.shape[1],))
+        known = (bitrates >= 0) & (bitrates < len(self._level_of))
+        return np.where(known, self._level_of[np.clip(bitrates, 0, len(self._level_of) - 1)], -1)
+
+    def _found(self, array, segment, levels):
+        segment = int(segment)
+        if not 0 <= segment < array.shape[0]:
+            return np.zeros(array.shape[1], dtype=bool)
+        return array[segment, np.arange(array.shape[1]), np.maximum(levels, 0)] & (levels >= 0)
+
+    def add(self, segment, tile, bitrate):
+        location = self._locate(segment, bitrate)
+        if location is not None:
+            self.delivered[location[0], int(tile), location[1]] = True
+
+    def exists(self, segment, tile, bitrate):
+        location = self._locate(segment, bitrate)
+        return location is not None and bool(self.delivered[location[0], int(tile), location[1]])
+
+    def request(self, segment, tiles, bitrate):
+        """
+        Marks tiles as requested, at a bitrate or at their entry of an array of per tile bitrates.
+        """
+        tiles = np.asarray(tiles, dtype=int)
+        levels = self._levels(bitrate)[tiles]
+        if 0 <= int(segment) < self.requested.shape[0]:
+            self.requested[int(segment), tiles[levels >= 0], levels[levels >= 0]] = True
+
+    def missing(self, segment, bitrate):
+        """
+        Boolean array over tile numbers, True for the tiles of the segment not delivered at that bitrate (or at their
+        entry of an array of per tile bitrates).
+        """
+        missing = ~self._found(self.delivered, segment, self._levels(bitrate))
+        missing[0] = False
+        return missing
+
+    def unrequested(self, segment, bitrate):
+        """
+        Same as missing, leaving out the tiles already requested and those not fetched at all.
+        """
+        levels = self._levels(bitrate)
+        return self.missing(segment, bitrate) & ~self._found(self.requested, segment, levels) & (levels >= 0)
+
+
+def tiles_mask(tiles, n_tiles=MAX_TILE):
+    """
+    Boolean array over tile numbers with the given tiles set.
+    """
+    mask = np.zeros(n_tiles, dtype=bool)
+    mask[tiles] = True
+    return mask
@@ -1,7 +1,6 @@
-import os
-
 from src.data_types import QUICPacket, VideoPacket
-from src.video_constants import SERVER_FILE_LOCATION, FILE_BASE_NAME, FILE_END_NAME, FILE_FORMAT, CLIENT_FILE_LOCATION
+from src.video_constants import SERVER_FILE_LOCATION, FILE_BASE_NAME, FILE_END_NAME, FILE_FORMAT, CLIENT_FILE_LOCATION, \
+    INIT_SEGMENT, INIT_FILE_END
 
 def message_to_QUICPacket(data):
     packet = QUICPacket(stream_id=data[0], end_stream=data[1])
@@ -13,11 +12,11 @@ def message_to_QUICPacket(data):
 def message_to_VideoPacket(data):
     return VideoPacket(segment=data[0], tile=data[1], priority=data[2], bitrate=data[3])
 
+def segment_file_end(segment):
+    return INIT_FILE_END if int(segment) == INIT_SEGMENT else str(segment).strip() + FILE_FORMAT
+
 def get_server_file_name(segment, tile, bitrate):
-    return SERVER_FILE_LOCATION + FILE_BASE_NAME + str(int(bitrate)).strip() + FILE_END_NAME + str(tile).strip() + '_' + str(segment).strip() + FILE_FORMAT
+    return SERVER_FILE_LOCATION + FILE_BASE_NAME + str(int(bitrate)).strip() + FILE_END_NAME + str(tile).strip() + '_' + segment_file_end(segment)
 
 def get_client_file_name(segment, tile, bitrate):
-    return CLIENT_FILE_LOCATION + FILE_BASE_NAME + str(int(bitrate)).strip() + FILE_END_NAME + str(tile).strip() + '_' + str(segment).strip() + FILE_FORMAT
-
-def segment_exists(segment, tile, bitrate):
-    return os.path.isfile(get_client_file_name(segment, tile, bitrate))
\ No newline at end of file
+    return CLIENT_FILE_LOCATION + FILE_BASE_NAME + str(int(bitrate)).strip() + FILE_END_NAME + str(tile).strip() + '_' + segment_file_end(segment)
\ No newline at end of file
@@ -5,15 +5,23 @@ FILE_BASE_NAME = 'video_tiled_'
 FILE_END_NAME = '_dash_track'
 CLIENT_FILE_BASE_NAME = 'data/client_files/video_tiled_dash_track'
 SERVER_FILE_BASE_NAME = 'data/segments/video_tiled_dash_track'
+CLIENT_RING_FILE = 'data/client_files/segments.ring'
+BUNDLE_LOCATION = 'data/bundles/'
 FILE_FORMAT = '.m4s'
+INIT_FILE_END = 'init.mp4'
 
 # Video information
 DASH = '10000'
 MAX_TILE = 201
+GRID_ROWS = 10  # Tiles are numbered from 1 in row order, GRID_COLS per row
+GRID_COLS = 20
 VIDEO_FPS = 30
 FRAME_TIME_MS = 33333
 N_SEGMENTS = 6
+INIT_SEGMENT = 0  # Segment number of the init segment of a tile
+SEGMENT_TIME = 1
 CLIENT_BITRATE = 1
+BITRATES = [1, 2, 5]
 
 # Priorities
 HIGH_PRIORITY = 1
@@ -23,8 +31,19 @@ LOW_PRIORITY = 2
 TILE_REQUEST = 'tile'
 PUSH_REQUEST = 'push'
 CLOSE_REQUEST = 'close'
+INIT_REQUEST = 'init'
 
 # Queues
 WFQ_QUEUE = 'WFQ'
 SP_QUEUE = 'SP'
-FIFO_QUEUE = 'FIFO'
\ No newline at end of file
+FIFO_QUEUE = 'FIFO'
+EDF_QUEUE = 'EDF'
+WFQ_WEIGHTS = [0.75, 0.25]  # Share of the bandwidth of each priority, from HIGH_PRIORITY down
+DROP_EXPIRED = 'drop'  # What the EDF queue does with tiles whose deadline passed
+DEMOTE_EXPIRED = 'demote'
+
+# Wire protocol
+HELLO_MARKER = 0
+PROTOCOL_TEXT = 0
+PROTOCOL_BINARY = 1
+SUPPORTED_PROTOCOLS = (PROTOCOL_TEXT, PROTOCOL_BINARY)
@@ -0,0 +1,226 @@
+import argparse
+import struct
+
+import numpy as np
+
+from src.prediction import dilate
+from src.tile_index import tiles_mask
+from src.video_constants import GRID_ROWS, GRID_COLS, MAX_TILE, SEGMENT_TIME, VIDEO_FPS
+
+
+def mask_to_grid(mask):
+    """
+    GRID_ROWS x GRID_COLS view of a mask over tile numbers.
+    """
+    return np.asarray(mask)[1:].reshape(GRID_ROWS, GRID_COLS)
+
+def grid_to_mask(grid):
+    mask = np.zeros(MAX_TILE, dtype=bool)
+    mask[1:] = np.asarray(grid, dtype=bool).ravel()
+    return mask
+
+def _neighbours():
+    neighbours = np.zeros((MAX_TILE, MAX_TILE), dtype=bool)
+    for tile in range(1, MAX_TILE):
+        neighbours[tile] = grid_to_mask(dilate(mask_to_grid(tiles_mask([tile]))))
+    return neighbours
+
+# Row t has tile t and its 8 neighbours on the grid set, wrapping around horizontally
+NEIGHBOURS = _neighbours()
+
+# Binary trace files: header (magic, version, tiles, frames per segment, bytes per packed mask, users, frames,
+# segments), then (first frame, frames, first segment, segments) of every user, the packed FOV of every frame and the
+# packed union of the FOVs of every segment
+TRACE_MAGIC = b'VPTR'
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct('<4sHHHHQQQ')
+TRACE_INDEX = np.dtype([('frame', '<u8'), ('frames', '<u8'), ('segment', '<u8'), ('segments', '<u8')])
+
+
+def complement(mask):
+    """
+    The tiles not in mask.
+    """
+    outside = ~np.asarray(mask, dtype=bool)
+    outside[0] = False
+    return outside
+
+def dilate_mask(mask, width=1):
+    """
+    The tiles of mask and those up to width tiles away from them.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    for _ in range(width):
+        mask = NEIGHBOURS[mask].any(axis=0)
+    return mask
+
+def margin(mask, width=1):
+    """
+    The tiles up to width tiles away from those of mask, without them.
+    """
+    return dilate_mask(mask, width) & ~np.asarray(mask, dtype=bool)
+
+
+class ViewportTrace:
+    """
+    FOV of every frame of a user input, parsed once into a (frames + 1, MAX_TILE) boolean array indexed by frame and
+    tile number (frame 0 is empty), with the tile numbers of each frame and the union of the FOVs of each segment.
+    """
+    def __init__(self, masks):
+        self.masks = np.asarray(masks, dtype=bool)
+        self.tiles = [np.flatnonzero(mask) for mask in self.masks]
+
+        frames_per_segment = SEGMENT_TIME * VIDEO_FPS
+        starts = np.arange(1, len(self.masks), frames_per_segment)
+        self.segments = np.zeros((len(starts) + 1, MAX_TILE), dtype=bool)
+        if len(starts):
+            self.segments[1:] = np.logical_or.reduceat(self.masks, starts, axis=0)
+
+    @classmethod
+    def read(cls, file_name, user=0):
+        """
+        Trace of a user input CSV, or of one of the users of a binary trace file.
+        """
+        if is_packed(file_name):
+            return PackedTraces(file_name).trace(user)
+        return cls.read_csv(file_name)
+
+    @classmethod
+    def read_csv(cls, file_name):
+        """
+        User input CSV: a header, then a row with the frame number and the tiles in the FOV for every frame.
+        """
+        with open(file_name) as csv_file:
+            rows = [line for line in csv_file.read().splitlines()[1:] if line.strip()]
+
+        masks = np.zeros((len(rows) + 1, MAX_TILE), dtype=bool)
+        for frame, row in enumerate(rows, 1):
+            tiles = row.split(',')[1:]
+            if tiles:
+                masks[frame, np.array(tiles, dtype=int)] = True
+        return cls(masks)
+
+    def __len__(self):
+        """
+        Number of frames.
+        """
+        return len(self.masks) - 1
+
+    def segment_fov(self, segment):
+        """
+        Tiles in the FOV during any frame of segment.
+        """
+        if not 0 < segment < len(self.segments):
+            return np.zeros(MAX_TILE, dtype=bool)
+        return self.segments[segment]
+
+
+class PackedTraces:
+    """
+    Binary trace file of many users, memory mapped: the FOV of any frame of any user is unpacked from its
+    (MAX_TILE + 7) // 8 bytes on demand, without reading the rest of the file.
+    """
+    def __init__(self, file_name):
+        with open(file_name, 'rb') as trace_file:
+            header = TRACE_HEADER.unpack(trace_file.read(TRACE_HEADER.size))
+        magic, version, self.n_tiles, self.frames_per_segment, row_bytes, n_users, n_frames, n_segments = header
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise ValueError('Not a version ' + str(TRACE_VERSION) + ' trace file: ' + str(file_name))
+
+        offset = TRACE_HEADER.size
+        self.index = np.memmap(file_name, dtype=TRACE_INDEX, mode='r', offset=offset, shape=(n_users,))
+        offset += TRACE_INDEX.itemsize * n_users
+        self.frames = np.memmap(file_name, dtype=np.uint8, mode='r', offset=offset, shape=(n_frames, row_bytes))
+        offset += n_frames * row_bytes
+        self.segments = np.memmap(file_name, dtype=np.uint8, mode='r', offset=offset, shape=(n_segments, row_bytes))
+
+    def __len__(self):
+        """
+        Number of users.
+        """
+        return len(self.index)
+
+    def n_frames(self, user):
+        return int(self.index[user]['frames'])
+
+    def fov(self, user, frame):
+        """
+        Mask of the tiles in the FOV at a frame (from 1) of a user.
+        """
+        if not 0 < frame <= self.n_frames(user):
+            raise IndexError('Frame ' + str(frame) + ' out of the trace of user ' + str(user))
+        row = self.frames[int(self.index[user]['frame']) + frame - 1]
+        return np.unpackbits(row, count=self.n_tiles).astype(bool)
+
+    def segment_fov(self, user, segment):
+        """
+        Mask of the tiles in the FOV during any frame of a segment (from 1) of a user.
+        """
+        if not 0 < segment <= int(self.index[user]['segments']):
+            return np.zeros(self.n_tiles, dtype=bool)
+        row = self.segments[int(self.index[user]['segment']) + segment - 1]
+        return np.unpackbits(row, count=self.n_tiles).astype(bool)
+
+    def trace(self, user):
+        """
+        ViewportTrace of a user, unpacking only their frames.
+        """
+        first, frames = int(self.index[user]['frame']), self.n_frames(user)
+        masks = np.zeros((frames + 1, self.n_tiles), dtype=bool)
+        masks[1:] = np.unpackbits(self.frames[first:first + frames], axis=1, count=self.n_tiles)
+        return ViewportTrace(masks)
+
+
+def is_packed(file_name):
+    with open(file_name, 'rb') as trace_file:
+        return trace_file.read(len(TRACE_MAGIC)) == TRACE_MAGIC
+
+def write_packed_traces(file_name, traces):
+    """
+    Writes the ViewportTraces of several users to a binary trace file.
+    """
+    row_bytes = (MAX_TILE + 7) // 8
+    index = np.zeros(len(traces), dtype=TRACE_INDEX)
+    frame = segment = 0
+    for user, trace in enumerate(traces):
+        index[user] = (frame, len(trace), segment, len(trace.segments) - 1)
+        frame += len(trace)
+        segment += len(trace.segments) - 1
+
+    with open(file_name, 'wb') as trace_file:
+        trace_file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, MAX_TILE, SEGMENT_TIME * VIDEO_FPS, row_bytes,
+                                           len(traces), frame, segment))
+        trace_file.write(index.tobytes())
+        for trace in traces:
+            trace_file.write(np.packbits(trace.masks[1:], axis=1).tobytes())
+        for trace in traces:
+            trace_file.write(np.packbits(trace.segments[1:], axis=1).tobytes())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converts user input CSV files to a binary trace file")
+    parser.add_argument(
+        "-o",
+        "--output",
+        required=True,
+        type=str,
+        help="binary trace file written, user N being the Nth input",
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        type=str,
+        help="user input CSV files (or binary trace files, whose users are all copied)",
+    )
+    args = parser.parse_args()
+
+    traces = []
+    for input_file in args.inputs:
+        if is_packed(input_file):
+            packed = PackedTraces(input_file)
+            traces.extend(packed.trace(user) for user in range(len(packed)))
+        else:
+            traces.append(ViewportTrace.read_csv(input_file))
+    write_packed_traces(args.output, traces)
+    print("Wrote " + str(len(traces)) + " users, " + str(sum(len(trace) for trace in traces)) + " frames to " +
+          args.output)
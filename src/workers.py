@@ -0,0 +1,103 @@
+import asyncio
+import json
+import multiprocessing
+import socket
+
+from aioquic.asyncio.server import QuicServer
+
+STATS_FIELDS = ('connections', 'sessions', 'tiles', 'bytes', 'cache_hits', 'cache_misses', 'expired', 'rejected')
+
+
+class WorkerStats:
+    """
+    Counters of one server process, a slot of the shared stats array.
+    """
+    def __init__(self, counters, worker):
+        self._counters = counters
+        self._offset = worker * len(STATS_FIELDS)
+        self._fields = {field: self._offset + index for index, field in enumerate(STATS_FIELDS)}
+
+    def add(self, field, value=1):
+        self._counters[self._fields[field]] += value
+
+    def set(self, field, value):
+        self._counters[self._fields[field]] = value
+
+
+class ServerStats:
+    """
+    Counters of all the server processes, in shared memory allocated before the workers are forked. Each worker only
+    writes its own slot, so no lock is needed, and the parent process adds them up when the stats are asked for.
+    """
+    def __init__(self, n_workers):
+        self.n_workers = n_workers
+        self._counters = multiprocessing.get_context('fork').RawArray('q', n_workers * len(STATS_FIELDS))
+
+    def worker(self, worker):
+        return WorkerStats(self._counters, worker)
+
+    def snapshot(self):
+        workers = []
+        for worker in range(self.n_workers):
+            offset = worker * len(STATS_FIELDS)
+            workers.append(dict(zip(STATS_FIELDS, self._counters[offset:offset + len(STATS_FIELDS)])))
+
+        total = {field: sum(worker[field] for worker in workers) for field in STATS_FIELDS}
+        return {'total': total, 'workers': workers}
+
+    async def serve(self, host, port):
+        """
+        Answers any HTTP request on host:port with the current stats as JSON.
+        """
+        async def handle_request(reader, writer):
+            try:
+                # Request line and headers, up to the empty line
+                while (await reader.readline()).strip():
+                    pass
+                body = json.dumps(self.snapshot()).encode()
+                writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\nContent-Length: " +
+                             str(len(body)).encode() + b"\r\n\r\n" + body)
+                await writer.drain()
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle_request, host, port)
+
+
+def reuseport_socket(host, port):
+    """
+    UDP socket bound to host:port with SO_REUSEPORT, so that every worker binds its own socket to the same port. The
+    kernel then spreads the clients over the workers by hashing their address, all the datagrams of a connection
+    reaching the same worker (as long as the client doesn't migrate to another address).
+    """
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    if family == socket.AF_INET6:
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+async def serve_reuseport(host, port, configuration, stream_handler):
+    """
+    Same as aioquic's serve(), but on a SO_REUSEPORT socket.
+    """
+    loop = asyncio.get_event_loop()
+    _, protocol = await loop.create_datagram_endpoint(
+        lambda: QuicServer(configuration=configuration, stream_handler=stream_handler),
+        sock=reuseport_socket(host, port),
+    )
+    return protocol
+
+
+def start_workers(n_workers, run_worker, *args):
+    """
+    Forks n_workers processes running run_worker(worker, *args), anything created before (shared memory maps, the
+    stats counters) being shared with them.
+    """
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=run_worker, args=(worker,) + args, daemon=True) for worker in range(n_workers)]
+    for worker in workers:
+        worker.start()
+    return workers
@@ -0,0 +1,86 @@
+import random
+from collections import deque
+
+import pytest
+
+from src.queues import WeightedFairQueue
+
+# WF2Q+ stays within a couple of packets of the GPS service of every class
+GPS_BOUND = 2
+
+
+def gps_service(classes, weights):
+    """
+    Fluid GPS reference on a link sending 1 byte per time unit, all the packets being queued at time 0: classes holds
+    the packet lengths of each class. Returns the times at which a packet completes and the bytes each class got by
+    then, service being linear in between.
+    """
+    waiting = [deque(lengths) for lengths in classes]
+    left = [lengths[0] if lengths else 0 for lengths in waiting]
+    served = [0.0] * len(classes)
+    times, service = [0.0], [list(served)]
+
+    while any(waiting):
+        active = [index for index, lengths in enumerate(waiting) if lengths]
+        total_weight = sum(weights[index] for index in active)
+        step = min(left[index] * total_weight / weights[index] for index in active)
+        for index in active:
+            progress = min(step * weights[index] / total_weight, left[index])
+            left[index] -= progress
+            served[index] += progress
+            if left[index] <= 1e-9 * waiting[index][0]:
+                waiting[index].popleft()
+                left[index] = waiting[index][0] if waiting[index] else 0
+        times.append(times[-1] + step)
+        service.append(list(served))
+
+    return times, service
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_wfq_follows_gps(seed):
+    """
+    After each packet sent, the bytes each class got are within GPS_BOUND maximum packet lengths of what GPS gave it.
+    """
+    rng = random.Random(seed)
+    n_classes = rng.randint(2, 6)
+    weights = [rng.uniform(0.05, 1) for _ in range(n_classes)]
+    classes = [[rng.randint(200, 20000) for _ in range(rng.randint(0, 50))] for _ in range(n_classes)]
+    max_length = max([length for lengths in classes for length in lengths], default=1)
+    times, service = gps_service(classes, weights)
+
+    queue = WeightedFairQueue(weights=weights)
+    for index, lengths in enumerate(classes):
+        for position, length in enumerate(lengths):
+            queue.put_nowait((index + 1, length, (index, position)))
+
+    now = 0
+    served = [0] * n_classes
+    event = 1
+    while not queue.empty():
+        index, position = queue.get_nowait()
+        now += classes[index][position]
+        served[index] += classes[index][position]
+
+        while event < len(times) - 1 and times[event] < now:
+            event += 1
+        ratio = (now - times[event - 1]) / max(times[event] - times[event - 1], 1e-12)
+        for other in range(n_classes):
+            gps = service[event - 1][other] + ratio * (service[event][other] - service[event - 1][other])
+            assert abs(served[other] - gps) <= GPS_BOUND * max_length
+
+
+def test_wfq_sends_everything_once():
+    queue = WeightedFairQueue(weights=[3, 1])
+    items = [(index % 2 + 1, 1000, index) for index in range(100)]
+    for item in items:
+        queue.put_nowait(item)
+    assert queue.qsize() == 100
+    assert sorted(queue.get_nowait() for _ in range(100)) == list(range(100))
+    assert queue.empty()
+
+
+@pytest.mark.parametrize("weights", [[1, 0], [0.75, -0.25], []])
+def test_wfq_rejects_weights_that_are_not_positive(weights):
+    with pytest.raises(ValueError):
+        WeightedFairQueue(weights=weights)